@@ -1,4 +1,5 @@
 from nonebot import require
+from nonebot.log import logger
 from nonebot.plugin import PluginMetadata, inherit_supported_adapters
 
 require("nonebot_plugin_alconna")
@@ -7,9 +8,21 @@ require("nonebot_plugin_uninfo")
 require("nonebot_plugin_localstore")
 require("nonebot_plugin_orm")
 
-from . import matchers as matchers
+from .utils import startup_phase, startup_timings
+
+# meme_generator 在首次导入时加载全部表情
+with startup_phase("加载 meme-generator"):
+    import meme_generator  # noqa: F401
+
+with startup_phase("加载插件"):
+    from . import matchers as matchers
 from .config import Config, memes_config
 
+logger.info(
+    "表情包插件加载耗时："
+    + "，".join(f"{name} {seconds:.3f}s" for name, seconds in startup_timings.items())
+)
+
 memes_prefixes = memes_config.memes_command_prefixes
 memes_prefix = memes_prefixes[0] if memes_prefixes else ""
 
@@ -41,7 +54,15 @@ __plugin_meta__ = PluginMetadata(
         "发送 “[我的][全局]<时间段>表情调用统计 [表情名]” 获取表情调用次数统计图\n"
         "“我的”、“全局”、<时间段>、“表情名” 均为可选项\n"
         "<时间段> 的关键词有：日、本日、周、本周、月、本月、年、本年\n"
-        "如：“我的今日表情调用统计 petpet”"
+        "如：“我的今日表情调用统计 petpet”\n"
+        "- 表情调用排行\n"
+        "发送 “[全局]<时间段>表情调用排行 [表情名]” 查看调用次数最多的用户或群聊\n"
+        "<时间段> 的关键词有：日、周、月、年\n"
+        "- 导出表情调用记录\n"
+        "“超级用户” 可以发送 “导出表情调用记录 [表情名] [-f csv/jsonl] [-d 天数]” "
+        "将表情调用记录导出到插件数据目录中\n"
+        "- 重载表情\n"
+        "“超级用户” 可以发送 “重载表情” 在不重启的情况下重新加载表情列表"
     ),
     type="application",
     homepage="https://github.com/noneplugin/nonebot-plugin-memes",
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Hashable
+from pathlib import Path
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+from meme_generator import Meme
+from nonebot.log import logger
+from nonebot.utils import run_sync
+from nonebot_plugin_localstore import get_cache_dir
+from nonebot_plugin_uninfo import User
+
+from .config import memes_config
+from .manager import meme_mtime
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+memes_cache_dir = get_cache_dir("nonebot_plugin_memes")
+plot_font_cache_file = memes_cache_dir / "plot_fonts.json"
+
+MB = 1024 * 1024
+
+
+class LRUCache(Generic[K, V]):
+    """内存 LRU 缓存
+
+    `max_items`、`max_bytes` 为 0 时不限制对应的容量；
+    设置 `ttl`（单位：秒）时，超时的缓存项视为不存在
+    """
+
+    def __init__(
+        self,
+        max_items: int = 0,
+        max_bytes: int = 0,
+        sizeof: Optional[Callable[[V], int]] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.size = 0
+        self.__data: OrderedDict[K, tuple[V, int, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: K) -> Optional[V]:
+        if key not in self.__data:
+            return None
+        value, _, expire_time = self.__data[key]
+        if expire_time and time.monotonic() > expire_time:
+            self.pop(key)
+            return None
+        self.__data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V):
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self.pop(key)
+        expire_time = time.monotonic() + self.ttl if self.ttl else 0
+        self.__data[key] = (value, size, expire_time)
+        self.size += size
+        while (self.max_items and len(self.__data) > self.max_items) or (
+            self.max_bytes and self.size > self.max_bytes
+        ):
+            _, (_, evicted_size, _) = self.__data.popitem(last=False)
+            self.size -= evicted_size
+
+    def pop(self, key: K) -> Optional[V]:
+        if key not in self.__data:
+            return None
+        value, size, _ = self.__data.pop(key)
+        self.size -= size
+        return value
+
+    def clear(self):
+        self.__data.clear()
+        self.size = 0
+
+
+class DiskCache:
+    """以文件形式存放的字节缓存，超出 `max_bytes` 时删除最早写入的文件"""
+
+    def __init__(self, path: Path, max_bytes: int = 0, ttl: Optional[float] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.__size: Optional[int] = None
+
+    def __file(self, key: str) -> Path:
+        return self.path / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        file = self.__file(key)
+        try:
+            if self.ttl and time.time() - file.stat().st_mtime > self.ttl:
+                return None
+            return file.read_bytes()
+        except OSError:
+            return None
+
+    def set(self, key: str, data: bytes):
+        file = self.__file(key)
+        try:
+            old_size = file.stat().st_size
+        except OSError:
+            old_size = 0
+        try:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # 先写入同目录下的临时文件再替换，读取时不会得到写了一半的文件
+            fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, file)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+        except OSError as e:
+            logger.warning(f"缓存文件 {file} 写入失败：{e}")
+            return
+        if self.__size is None:
+            self.__size = sum(f.stat().st_size for f in self.__files())
+        else:
+            self.__size += len(data) - old_size
+        if self.max_bytes and self.__size > self.max_bytes:
+            self.__prune()
+
+    def __files(self) -> list[Path]:
+        return [f for f in self.path.glob("*/*") if f.is_file()]
+
+    def __prune(self):
+        files = sorted(
+            ((f, f.stat()) for f in self.__files()), key=lambda f: f[1].st_mtime
+        )
+        size = sum(stat.st_size for _, stat in files)
+        # 清理到容量的 90% 以下，避免频繁扫描目录
+        for file, stat in files:
+            if size <= self.max_bytes * 0.9:
+                break
+            file.unlink(missing_ok=True)
+            size -= stat.st_size
+        self.__size = size
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class TieredCache:
+    """内存 + 磁盘两级字节缓存，容量单位为 MB，为 0 时不启用对应的缓存"""
+
+    def __init__(
+        self,
+        name: str,
+        memory_size: int,
+        disk_size: int = 0,
+        ttl: Optional[float] = None,
+    ):
+        self.memory = (
+            LRUCache[str, bytes](max_bytes=memory_size * MB, sizeof=len, ttl=ttl)
+            if memory_size > 0
+            else None
+        )
+        self.disk = (
+            DiskCache(memes_cache_dir / name, max_bytes=disk_size * MB, ttl=ttl)
+            if disk_size > 0
+            else None
+        )
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if self.memory is not None and (data := self.memory.get(key)) is not None:
+            return data
+        if self.disk is None:
+            return None
+        if (data := await run_sync(self.disk.get)(key)) is not None:
+            if self.memory is not None:
+                self.memory.set(key, data)
+            return data
+        return None
+
+    async def set(self, key: str, data: bytes):
+        if self.memory is not None:
+            self.memory.set(key, data)
+        if self.disk is not None:
+            await run_sync(self.disk.set)(key, data)
+
+
+result_cache = TieredCache(
+    "results",
+    memory_size=memes_config.memes_result_cache_memory_size,
+    disk_size=memes_config.memes_result_cache_disk_size,
+)
+avatar_cache = TieredCache(
+    "avatars",
+    memory_size=memes_config.memes_avatar_cache_memory_size,
+    disk_size=memes_config.memes_avatar_cache_disk_size,
+    ttl=memes_config.memes_avatar_cache_ttl.total_seconds(),
+)
+
+user_cache = LRUCache[tuple[Any, ...], User](
+    max_items=4096, ttl=memes_config.memes_user_cache_ttl.total_seconds()
+)
+
+statistics_cache = LRUCache[tuple[Any, ...], bytes](
+    max_bytes=memes_config.memes_statistics_cache_memory_size * MB,
+    sizeof=len,
+    ttl=memes_config.memes_statistics_cache_ttl.total_seconds(),
+)
+
+
+meme_versions: Counter[str] = Counter()
+""" 各表情被重新加载的次数，用于使重新加载前的生成结果缓存失效；
+重启后会重置，表情文件的修改由 `meme_mtime` 区分 """
+
+
+NONDETERMINISTIC_SOURCE = re.compile(
+    r"\brandom\b|\b(?:now|today|localtime)\(|\btime\(\)"
+)
+""" 表情源码中使用随机数或当前时间的特征，匹配时生成结果不只由输入决定 """
+
+_cacheable_memes: dict[str, tuple[Meme, bool]] = {}
+
+
+def meme_source_files(meme: Meme) -> list[Path]:
+    code = getattr(meme.function, "__code__", None)
+    if code is None:
+        return []
+    path = Path(code.co_filename)
+    if path.name == "__init__.py":
+        return list(path.parent.rglob("*.py"))
+    return [path]
+
+
+def is_result_cacheable(meme: Meme) -> bool:
+    """表情的生成结果是否可以缓存
+
+    在 `memes_result_cache_skip_list` 中，或源码中使用了随机数、当前时间的表情不缓存；
+    无法读取源码时也不缓存
+    """
+    if meme.key in memes_config.memes_result_cache_skip_list:
+        return False
+    if (cached := _cacheable_memes.get(meme.key)) and cached[0] is meme:
+        return cached[1]
+    cacheable = False
+    if files := meme_source_files(meme):
+        try:
+            cacheable = not any(
+                NONDETERMINISTIC_SOURCE.search(file.read_text("utf-8"))
+                for file in files
+            )
+        except (OSError, UnicodeDecodeError):
+            pass
+    _cacheable_memes[meme.key] = (meme, cacheable)
+    return cacheable
+
+
+def meme_result_key(
+    meme: Meme, images: list[bytes], texts: list[str], args: dict[str, Any]
+) -> str:
+    content = json.dumps(
+        [
+            meme.key,
+            meme.date_modified.isoformat(),
+            meme_versions[meme.key],
+            meme_mtime(meme.key),
+            [digest(image) for image in images],
+            texts,
+            args,
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return digest(content.encode("utf-8"))
+
+
+def avatar_key(scope: str, self_id: str, user_id: str, url: str) -> str:
+    content = json.dumps([scope, self_id, user_id, url], ensure_ascii=False)
+    return digest(content.encode("utf-8"))
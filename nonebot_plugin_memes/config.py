@@ -26,6 +26,36 @@ class Config(BaseModel):
     memes_use_default_when_no_text: bool = False
     memes_random_meme_show_info: bool = True
     memes_list_image_config: MemeListImageConfig = MemeListImageConfig()
+    memes_render_backend: Literal["thread", "process"] = "thread"
+    memes_render_workers: Optional[int] = None
+    memes_render_max_queued: int = 0
+    memes_max_concurrency: int = 16
+    memes_max_concurrency_per_scene: int = 4
+    memes_max_queue_size: int = 100
+    memes_max_queue_wait: float = 60
+    memes_overload_show_position: bool = False
+    memes_image_fetch_timeout: float = 20
+    memes_image_fetch_deadline: float = 30
+    memes_result_cache_memory_size: int = 64
+    memes_result_cache_disk_size: int = 0
+    memes_result_cache_skip_list: list[str] = []
+    memes_avatar_cache_ttl: timedelta = timedelta(hours=12)
+    memes_avatar_cache_memory_size: int = 32
+    memes_avatar_cache_disk_size: int = 0
+    memes_user_cache_ttl: timedelta = timedelta(minutes=5)
+    memes_preview_cache_memory_size: int = 32
+    memes_preview_cache_disk: bool = True
+    memes_preview_pregenerate: bool = False
+    memes_record_batch_size: int = 100
+    memes_record_flush_interval: float = 5
+    memes_record_retention_days: int = 0
+    memes_record_compact_batch_size: int = 1000
+    memes_statistics_cache_ttl: timedelta = timedelta(minutes=5)
+    memes_statistics_cache_memory_size: int = 16
+    memes_plot_warmup: bool = False
+    memes_export_batch_size: int = 5000
+    memes_dispatch_mode: Literal["matcher", "trie"] = "matcher"
+    memes_permission_store: Literal["yaml", "database"] = "yaml"
 
 
 memes_config = get_plugin_config(Config)
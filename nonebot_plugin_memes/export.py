@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+from dataclasses import asdict, fields
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Literal, Optional, TextIO
+
+from nonebot.utils import run_sync
+from nonebot_plugin_localstore import get_data_dir
+
+from .config import memes_config
+from .recorder import MemeRecordDetail, iter_meme_generation_records
+
+ExportFormat = Literal["csv", "jsonl"]
+
+export_dir = get_data_dir("nonebot_plugin_memes") / "exports"
+export_fields = [field.name for field in fields(MemeRecordDetail)]
+
+
+def format_records(records: list[MemeRecordDetail], format: ExportFormat) -> str:
+    rows = []
+    for record in records:
+        row = asdict(record)
+        row["time"] = record.time.replace(tzinfo=timezone.utc).isoformat()
+        rows.append(row)
+    if format == "jsonl":
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    output = io.StringIO()
+    csv.DictWriter(output, export_fields, lineterminator="\n").writerows(rows)
+    return output.getvalue()
+
+
+@run_sync
+def open_file(path: Path, format: ExportFormat) -> TextIO:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    file = path.open("w", encoding="utf-8", newline="")
+    if format == "csv":
+        file.write(",".join(export_fields) + "\n")
+    return file
+
+
+@run_sync
+def write_records(file: TextIO, records: list[MemeRecordDetail], format: ExportFormat):
+    file.write(format_records(records, format))
+
+
+async def export_meme_generation_records(
+    format: ExportFormat = "csv",
+    *,
+    meme_key: Optional[str] = None,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+) -> tuple[Path, int]:
+    """将表情调用记录导出到数据目录下的 `exports` 文件夹中，返回文件路径和记录数量
+
+    记录分批读取和写入，内存占用与记录总数无关；
+    导出完成前写入临时文件，完成后再重命名
+    """
+    filename = f"records_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.{format}"
+    path = export_dir / filename
+    temp_path = path.with_name(path.name + ".part")
+
+    count = 0
+    file = await open_file(temp_path, format)
+    try:
+        async for records in iter_meme_generation_records(
+            meme_key=meme_key,
+            time_start=time_start,
+            time_stop=time_stop,
+            batch_size=memes_config.memes_export_batch_size,
+        ):
+            await write_records(file, records, format)
+            count += len(records)
+    except BaseException:
+        await run_sync(file.close)()
+        temp_path.unlink(missing_ok=True)
+        raise
+    await run_sync(file.close)()
+    temp_path.replace(path)
+    return path, count
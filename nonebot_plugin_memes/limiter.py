@@ -0,0 +1,139 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from .config import memes_config
+
+
+class Overloaded(Exception):
+    def __init__(self, timeout: bool = False):
+        self.timeout = timeout
+
+
+@dataclass
+class AdmissionStats:
+    running: int = 0
+    """ 正在制作的数量 """
+    queued: int = 0
+    """ 正在排队的数量 """
+    admitted: int = 0
+    """ 累计放行的数量 """
+    rejected: int = 0
+    """ 累计因队列已满被拒绝的数量 """
+    timeout: int = 0
+    """ 累计因等待超时被拒绝的数量 """
+
+
+class AdmissionController:
+    """表情制作并发控制
+
+    同时限制全局和每个会话的并发数；超出时按到达顺序进入等待队列，
+    有空闲名额时分配给队列中最早到达、且所在会话未达到并发上限的请求；
+    队列已满或等待超时时抛出 `Overloaded`
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_concurrency_per_scene: int,
+        max_queue_size: int,
+        max_wait: float,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_scene = max_concurrency_per_scene
+        self.max_queue_size = max_queue_size
+        self.max_wait = max_wait
+        self.stats = AdmissionStats()
+        self.__running: dict[str, int] = {}
+        self.__waiters: deque[tuple[str, asyncio.Future[None]]] = deque()
+
+    def __full(self) -> bool:
+        return bool(self.max_concurrency and self.stats.running >= self.max_concurrency)
+
+    def __available(self, scene_id: str) -> bool:
+        if self.__full():
+            return False
+        if (
+            self.max_concurrency_per_scene
+            and self.__running.get(scene_id, 0) >= self.max_concurrency_per_scene
+        ):
+            return False
+        return True
+
+    def __start(self, scene_id: str):
+        self.stats.running += 1
+        self.stats.admitted += 1
+        self.__running[scene_id] = self.__running.get(scene_id, 0) + 1
+
+    def __finish(self, scene_id: str):
+        self.stats.running -= 1
+        self.__running[scene_id] -= 1
+        if not self.__running[scene_id]:
+            del self.__running[scene_id]
+        self.__dispatch()
+
+    def __dispatch(self):
+        """按到达顺序将空闲的名额分配给等待中的请求"""
+        waiters: deque[tuple[str, asyncio.Future[None]]] = deque()
+        while self.__waiters and not self.__full():
+            scene_id, waiter = self.__waiters.popleft()
+            if self.__available(scene_id):
+                self.__start(scene_id)
+                waiter.set_result(None)
+            else:
+                waiters.append((scene_id, waiter))
+        waiters.extend(self.__waiters)
+        self.__waiters = waiters
+        self.stats.queued = len(waiters)
+
+    def queue_position(self, scene_id: str) -> Optional[int]:
+        """当前请求需要排队时，返回排队位置"""
+        if self.__available(scene_id):
+            return None
+        return len(self.__waiters) + 1
+
+    async def __wait(self, scene_id: str):
+        if self.max_queue_size and len(self.__waiters) >= self.max_queue_size:
+            self.stats.rejected += 1
+            raise Overloaded
+        waiter = asyncio.get_running_loop().create_future()
+        self.__waiters.append((scene_id, waiter))
+        self.stats.queued = len(self.__waiters)
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter), timeout=self.max_wait or None
+            )
+        except BaseException as e:
+            if waiter.done():
+                # 超时或取消的同时已分配到名额，归还名额
+                self.__finish(scene_id)
+            else:
+                waiter.cancel()
+                self.__waiters.remove((scene_id, waiter))
+                self.stats.queued = len(self.__waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats.timeout += 1
+                raise Overloaded(timeout=True)
+            raise
+
+    @asynccontextmanager
+    async def acquire(self, scene_id: str) -> AsyncIterator[None]:
+        if self.__available(scene_id):
+            self.__start(scene_id)
+        else:
+            await self.__wait(scene_id)
+        try:
+            yield
+        finally:
+            self.__finish(scene_id)
+
+
+admission_controller = AdmissionController(
+    max_concurrency=memes_config.memes_max_concurrency,
+    max_concurrency_per_scene=memes_config.memes_max_concurrency_per_scene,
+    max_queue_size=memes_config.memes_max_queue_size,
+    max_wait=memes_config.memes_max_queue_wait,
+)
@@ -1,20 +1,54 @@
+import asyncio
+import importlib.util
+import pkgutil
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 from enum import IntEnum
+from importlib.abc import Loader
+from importlib.machinery import ModuleSpec
 from pathlib import Path
 from typing import Any, Optional
 
 import yaml
+from meme_generator.config import meme_config as meme_generator_config
 from meme_generator.manager import get_memes
 from meme_generator.meme import Meme
+from nonebot import get_driver
 from nonebot.compat import PYDANTIC_V2, model_dump, type_validate_python
 from nonebot.log import logger
+from nonebot.utils import run_sync
 from nonebot_plugin_localstore import get_config_file
 from pydantic import BaseModel
 from rapidfuzz import process
 
 from .config import memes_config
+from .permission import (
+    add_entry,
+    import_permissions,
+    is_permissions_empty,
+    load_permissions,
+    remove_entry,
+    save_mode,
+)
+from .utils import startup_phase
+
+try:
+    # meme-generator 没有提供移除表情的接口，
+    # 重新加载修改过的表情时需要修改其内部的表情列表
+    from meme_generator.manager import _memes as registered_memes
+except ImportError:
+    registered_memes: Optional[dict[str, Meme]] = None
+    logger.warning(
+        "当前版本的 meme-generator 中没有内部表情列表 _memes，"
+        "重载表情时将只加载新增的表情，不会重新加载修改过的表情"
+    )
 
 config_path = get_config_file("nonebot_plugin_memes", "meme_manager.yml")
 
+# 优先使用 libyaml 提供的 C 实现
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 class MemeMode(IntEnum):
     BLACK = 0
@@ -38,23 +72,83 @@ class MemeConfig(BaseModel):
             use_enum_values = True
 
 
+@dataclass
+class MemeDiff:
+    """表情列表重新加载前后的差异"""
+
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed or self.updated)
+
+
 class MemeManager:
     def __init__(self, path: Path = config_path):
         self.__path = path
         self.__meme_config: dict[str, MemeConfig] = {}
-        self.__meme_dict = {
+        with startup_phase("获取表情列表"):
+            self.__meme_dict = self.__get_meme_dict()
+        self.__meme_names: dict[str, list[Meme]] = {}
+        self.__meme_tags: dict[str, list[Meme]] = {}
+        # 权限索引：各管控模式下的表情，以及用户所在黑/白名单的表情
+        self.__black_mode_memes: set[str] = set()
+        self.__white_mode_memes: set[str] = set()
+        self.__black_list_index: dict[str, set[str]] = {}
+        self.__white_list_index: dict[str, set[str]] = {}
+        self.__use_database = False
+        self.__dump_lock: Optional[asyncio.Lock] = None
+        with startup_phase("读取表情配置"):
+            changed = self.__load()
+            self.__refresh_index()
+        # 配置文件内容没有变化时不再重新写入
+        if changed:
+            with startup_phase("保存表情配置"):
+                self.__dump()
+        with startup_phase("构建表情索引"):
+            self.__refresh_names()
+            self.__refresh_tags()
+
+    @staticmethod
+    def __get_meme_dict() -> dict[str, Meme]:
+        return {
             meme.key: meme
             for meme in filter(
                 lambda meme: meme.key not in memes_config.memes_disabled_list,
                 sorted(get_memes(), key=lambda meme: meme.key),
             )
         }
-        self.__meme_names: dict[str, list[Meme]] = {}
-        self.__meme_tags: dict[str, list[Meme]] = {}
-        self.__load()
-        self.__dump()
-        self.__refresh_names()
-        self.__refresh_tags()
+
+    async def reload(self) -> MemeDiff:
+        """重新读取 meme-generator 中的表情列表，只更新有变化的表情
+
+        表情对象被重新注册时视为更新
+        """
+        meme_dict = self.__get_meme_dict()
+        diff = MemeDiff(
+            added=[key for key in meme_dict if key not in self.__meme_dict],
+            removed=[key for key in self.__meme_dict if key not in meme_dict],
+            updated=[
+                key
+                for key, meme in meme_dict.items()
+                if key in self.__meme_dict and self.__meme_dict[key] is not meme
+            ],
+        )
+        for meme_key in diff.removed + diff.updated:
+            self.__remove_from_index(self.__meme_dict[meme_key])
+        self.__meme_dict = meme_dict
+        for meme_key in diff.added + diff.updated:
+            self.__add_to_index(meme_dict[meme_key])
+
+        new_keys = [key for key in diff.added if key not in self.__meme_config]
+        for meme_key in new_keys:
+            self.__meme_config[meme_key] = MemeConfig()
+            self.__black_mode_memes.add(meme_key)
+        if new_keys:
+            await self.__save()
+        return diff
 
     def get_meme(self, meme_key: str) -> Optional[Meme]:
         return self.__meme_dict.get(meme_key, None)
@@ -62,26 +156,83 @@ class MemeManager:
     def get_memes(self) -> list[Meme]:
         return list(self.__meme_dict.values())
 
-    def block(self, user_id: str, meme_key: str):
+    async def block(self, user_id: str, meme_key: str):
         config = self.__meme_config[meme_key]
-        if config.mode == MemeMode.BLACK and user_id not in config.black_list:
+        black_memes = self.__black_list_index.setdefault(user_id, set())
+        white_memes = self.__white_list_index.setdefault(user_id, set())
+        if config.mode == MemeMode.BLACK and meme_key not in black_memes:
             config.black_list.append(user_id)
-        if config.mode == MemeMode.WHITE and user_id in config.white_list:
-            config.white_list.remove(user_id)
-        self.__dump()
+            black_memes.add(meme_key)
+            await self.__add_entry(meme_key, MemeMode.BLACK, user_id)
+        if config.mode == MemeMode.WHITE and meme_key in white_memes:
+            config.white_list = [uid for uid in config.white_list if uid != user_id]
+            white_memes.discard(meme_key)
+            await self.__remove_entry(meme_key, MemeMode.WHITE, user_id)
+        await self.__save()
 
-    def unblock(self, user_id: str, meme_key: str):
+    async def unblock(self, user_id: str, meme_key: str):
         config = self.__meme_config[meme_key]
-        if config.mode == MemeMode.WHITE and user_id not in config.white_list:
+        black_memes = self.__black_list_index.setdefault(user_id, set())
+        white_memes = self.__white_list_index.setdefault(user_id, set())
+        if config.mode == MemeMode.WHITE and meme_key not in white_memes:
             config.white_list.append(user_id)
-        if config.mode == MemeMode.BLACK and user_id in config.black_list:
-            config.black_list.remove(user_id)
-        self.__dump()
+            white_memes.add(meme_key)
+            await self.__add_entry(meme_key, MemeMode.WHITE, user_id)
+        if config.mode == MemeMode.BLACK and meme_key in black_memes:
+            config.black_list = [uid for uid in config.black_list if uid != user_id]
+            black_memes.discard(meme_key)
+            await self.__remove_entry(meme_key, MemeMode.BLACK, user_id)
+        await self.__save()
 
-    def change_mode(self, mode: MemeMode, meme_key: str):
+    async def change_mode(self, mode: MemeMode, meme_key: str):
         config = self.__meme_config[meme_key]
         config.mode = mode
-        self.__dump()
+        self.__black_mode_memes.discard(meme_key)
+        self.__white_mode_memes.discard(meme_key)
+        if mode == MemeMode.BLACK:
+            self.__black_mode_memes.add(meme_key)
+        elif mode == MemeMode.WHITE:
+            self.__white_mode_memes.add(meme_key)
+        if self.__use_database:
+            await save_mode(meme_key, mode.value)
+        await self.__save()
+
+    async def load_database(self):
+        """从数据库中读取表情管控配置
+
+        数据库中没有配置时，将配置文件中的内容导入数据库；
+        之后的修改只写入数据库中对应的行，不再写入配置文件
+        """
+        if await is_permissions_empty():
+            modes = {
+                meme_key: MemeMode(config.mode).value
+                for meme_key, config in self.__meme_config.items()
+            }
+            entries = [
+                (meme_key, list_type.value, user_id)
+                for meme_key, config in self.__meme_config.items()
+                for list_type, user_ids in (
+                    (MemeMode.BLACK, config.black_list),
+                    (MemeMode.WHITE, config.white_list),
+                )
+                for user_id in user_ids
+            ]
+            await import_permissions(modes, entries)
+            logger.info(f"已将 {len(modes)} 个表情的管控配置从配置文件导入数据库")
+        else:
+            modes, entries = await load_permissions()
+            meme_config = {meme_key: MemeConfig() for meme_key in self.__meme_dict}
+            for meme_key, mode in modes.items():
+                meme_config.setdefault(meme_key, MemeConfig()).mode = MemeMode(mode)
+            for meme_key, list_type, user_id in entries:
+                config = meme_config.setdefault(meme_key, MemeConfig())
+                if list_type == MemeMode.WHITE:
+                    config.white_list.append(user_id)
+                else:
+                    config.black_list.append(user_id)
+            self.__meme_config = meme_config
+        self.__use_database = True
+        self.__refresh_index()
 
     def find(self, meme_name: str) -> list[Meme]:
         meme_name = meme_name.lower()
@@ -117,25 +268,27 @@ class MemeManager:
         return list(result.values())
 
     def check(self, user_id: str, meme_key: str) -> bool:
-        if meme_key not in self.__meme_config:
-            return False
-        config = self.__meme_config[meme_key]
-        if config.mode == MemeMode.BLACK:
-            if user_id in config.black_list:
-                return False
-            return True
-        elif config.mode == MemeMode.WHITE:
-            if user_id in config.white_list:
-                return True
-            return False
+        if meme_key in self.__black_mode_memes:
+            return meme_key not in self.__black_list_index.get(user_id, ())
+        elif meme_key in self.__white_mode_memes:
+            return meme_key in self.__white_list_index.get(user_id, ())
         return False
 
-    def __load(self):
+    def allowed_memes(self, user_id: str) -> set[str]:
+        """用户可以使用的所有表情名"""
+        black_memes = self.__black_list_index.get(user_id, set())
+        white_memes = self.__white_list_index.get(user_id, set())
+        return (self.__black_mode_memes - black_memes) | (
+            self.__white_mode_memes & white_memes
+        )
+
+    def __load(self) -> bool:
+        """读取配置文件，返回配置文件是否需要重新写入"""
         raw_list: dict[str, Any] = {}
         if self.__path.exists():
             with self.__path.open("r", encoding="utf-8") as f:
                 try:
-                    raw_list = yaml.safe_load(f)
+                    raw_list = yaml.load(f, Loader=YamlLoader)
                 except Exception:
                     logger.warning("表情列表解析失败，将重新生成")
         try:
@@ -150,25 +303,69 @@ class MemeManager:
             meme_key: MemeConfig() for meme_key in self.__meme_dict.keys()
         }
         self.__meme_config.update(meme_list)
+        return self.__dump_config() != raw_list
 
-    def __dump(self):
+    def __dump_config(self) -> dict[str, Any]:
+        return {name: model_dump(config) for name, config in self.__meme_config.items()}
+
+    def __dump(self, meme_list: Optional[dict[str, Any]] = None):
         self.__path.parent.mkdir(parents=True, exist_ok=True)
-        meme_list = {
-            name: model_dump(config) for name, config in self.__meme_config.items()
-        }
+        if meme_list is None:
+            meme_list = self.__dump_config()
         with self.__path.open("w", encoding="utf-8") as f:
-            yaml.dump(meme_list, f, allow_unicode=True)
+            yaml.dump(meme_list, f, Dumper=YamlDumper, allow_unicode=True)
+
+    async def __save(self):
+        """使用配置文件存储时，在线程中写入配置文件"""
+        if self.__use_database:
+            return
+        if self.__dump_lock is None:
+            self.__dump_lock = asyncio.Lock()
+        meme_list = self.__dump_config()
+        async with self.__dump_lock:
+            await run_sync(self.__dump)(meme_list)
+
+    async def __add_entry(self, meme_key: str, list_type: MemeMode, user_id: str):
+        if self.__use_database:
+            await add_entry(meme_key, list_type.value, user_id)
+
+    async def __remove_entry(self, meme_key: str, list_type: MemeMode, user_id: str):
+        if self.__use_database:
+            await remove_entry(meme_key, list_type.value, user_id)
+
+    def __refresh_index(self):
+        self.__black_mode_memes = set()
+        self.__white_mode_memes = set()
+        self.__black_list_index = {}
+        self.__white_list_index = {}
+        for meme_key, config in self.__meme_config.items():
+            if config.mode == MemeMode.BLACK:
+                self.__black_mode_memes.add(meme_key)
+            elif config.mode == MemeMode.WHITE:
+                self.__white_mode_memes.add(meme_key)
+            for user_id in config.black_list:
+                self.__black_list_index.setdefault(user_id, set()).add(meme_key)
+            for user_id in config.white_list:
+                self.__white_list_index.setdefault(user_id, set()).add(meme_key)
+
+    @staticmethod
+    def __names_of(meme: Meme) -> set[str]:
+        names = set()
+        names.add(meme.key.lower())
+        for keyword in meme.keywords:
+            names.add(keyword.lower())
+        for shortcut in meme.shortcuts:
+            names.add((shortcut.humanized or shortcut.key).lower())
+        return names
+
+    @staticmethod
+    def __tags_of(meme: Meme) -> set[str]:
+        return {tag.lower() for tag in meme.tags}
 
     def __refresh_names(self):
         self.__meme_names = {}
         for meme in self.__meme_dict.values():
-            names = set()
-            names.add(meme.key.lower())
-            for keyword in meme.keywords:
-                names.add(keyword.lower())
-            for shortcut in meme.shortcuts:
-                names.add((shortcut.humanized or shortcut.key).lower())
-            for name in names:
+            for name in self.__names_of(meme):
                 if name not in self.__meme_names:
                     self.__meme_names[name] = []
                 self.__meme_names[name].append(meme)
@@ -176,11 +373,136 @@ class MemeManager:
     def __refresh_tags(self):
         self.__meme_tags = {}
         for meme in self.__meme_dict.values():
-            for tag in meme.tags:
-                tag = tag.lower()
+            for tag in self.__tags_of(meme):
                 if tag not in self.__meme_tags:
                     self.__meme_tags[tag] = []
                 self.__meme_tags[tag].append(meme)
 
+    def __add_to_index(self, meme: Meme):
+        for index, keys in (
+            (self.__meme_names, self.__names_of(meme)),
+            (self.__meme_tags, self.__tags_of(meme)),
+        ):
+            for key in keys:
+                memes = index.setdefault(key, [])
+                memes.append(meme)
+                memes.sort(key=lambda meme: meme.key)
+
+    def __remove_from_index(self, meme: Meme):
+        for index, keys in (
+            (self.__meme_names, self.__names_of(meme)),
+            (self.__meme_tags, self.__tags_of(meme)),
+        ):
+            for key in keys:
+                memes = [m for m in index.get(key, []) if m is not meme]
+                if memes:
+                    index[key] = memes
+                else:
+                    index.pop(key, None)
+
+
+def iter_meme_modules() -> Iterator[tuple[str, ModuleSpec, Loader]]:
+    """meme-generator 配置的额外表情目录中的表情模块"""
+    for meme_dir in meme_generator_config.meme.meme_dirs:
+        for module_info in pkgutil.iter_modules([str(Path(meme_dir).resolve())]):
+            if module_info.name.startswith("_"):
+                continue
+            spec = module_info.module_finder.find_spec(module_info.name, None)
+            if spec and spec.origin and spec.loader:
+                yield spec.origin, spec, spec.loader
+
+
+def module_paths(origin: str, spec: ModuleSpec) -> list[Path]:
+    """表情模块包含的源文件，模块为包时包括包中的所有文件"""
+    if spec.submodule_search_locations is None:
+        return [Path(origin)]
+    return list(Path(origin).parent.rglob("*.py"))
+
+
+def module_mtime(origin: str, spec: ModuleSpec) -> float:
+    return max(path.stat().st_mtime for path in module_paths(origin, spec))
+
+
+def module_memes(origin: str, spec: ModuleSpec) -> dict[str, Meme]:
+    """表情模块中注册的表情"""
+    paths = {str(path) for path in module_paths(origin, spec)}
+    return {
+        meme.key: meme
+        for meme in get_memes()
+        if (code := getattr(meme.function, "__code__", None))
+        and code.co_filename in paths
+    }
+
+
+_module_mtimes: dict[str, float] = {}
+""" 额外表情目录中已加载的表情模块及加载时的修改时间 """
+_meme_mtimes: dict[str, float] = {}
+""" 额外表情目录中的表情所在模块加载时的修改时间 """
+
+
+def record_module(origin: str, spec: ModuleSpec, mtime: float):
+    _module_mtimes[origin] = mtime
+    for meme_key in module_memes(origin, spec):
+        _meme_mtimes[meme_key] = mtime
+
+
+def meme_mtime(meme_key: str) -> float:
+    """表情所在模块加载时的修改时间，不在额外表情目录中的表情返回 0
+
+    重启后仍然不变，用于使表情文件修改前的生成结果缓存失效
+    """
+    return _meme_mtimes.get(meme_key, 0)
+
+
+def snapshot_meme_modules():
+    for origin, spec, _ in iter_meme_modules():
+        try:
+            record_module(origin, spec, module_mtime(origin, spec))
+        except (OSError, ValueError):
+            pass
+
+
+snapshot_meme_modules()
+
+
+def load_new_memes():
+    """从 meme-generator 配置的额外表情目录中加载新增的表情，并重新加载文件有修改的表情
+
+    模块重新执行前先从 meme-generator 中移除该模块注册的表情，执行失败时恢复
+    """
+    for origin, spec, loader in iter_meme_modules():
+        try:
+            mtime = module_mtime(origin, spec)
+        except (OSError, ValueError):
+            continue
+        if _module_mtimes.get(origin) == mtime:
+            continue
+        if origin in _module_mtimes and registered_memes is None:
+            continue
+
+        old_memes = module_memes(origin, spec)
+        if registered_memes is not None:
+            for meme_key in old_memes:
+                registered_memes.pop(meme_key, None)
+        try:
+            module = importlib.util.module_from_spec(spec)
+            loader.exec_module(module)
+        except Exception as e:
+            logger.warning(f"表情 {origin} 加载失败：{e!r}")
+            if registered_memes is not None:
+                for meme_key, meme in old_memes.items():
+                    registered_memes.setdefault(meme_key, meme)
+            # 文件再次修改前不再尝试加载
+            _module_mtimes[origin] = mtime
+            continue
+        record_module(origin, spec, mtime)
+
 
 meme_manager = MemeManager()
+
+
+if memes_config.memes_permission_store == "database":
+
+    @get_driver().on_startup
+    async def _():
+        await meme_manager.load_database()
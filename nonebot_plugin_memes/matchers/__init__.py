@@ -1,6 +1,9 @@
 from . import command as command
+from . import dispatch as dispatch
+from . import export as export
 from . import help as help
 from . import info as info
+from . import leaderboard as leaderboard
 from . import manage as manage
 from . import search as search
 from . import statistics as statistics
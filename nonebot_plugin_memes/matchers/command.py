@@ -1,20 +1,24 @@
+import asyncio
 import random
 import traceback
-from typing import Any, NoReturn, Union
+from copy import copy
+from typing import Any, NoReturn, Optional, Union
 
+from arclet.alconna import Arparma
 from arclet.alconna import config as alc_config
 from meme_generator import Meme
 from meme_generator.exception import MemeGeneratorException
 from nonebot import get_driver
 from nonebot.adapters import Bot, Event
+from nonebot.dependencies import Dependent
 from nonebot.exception import AdapterException
 from nonebot.log import logger
 from nonebot.matcher import Matcher
 from nonebot.typing import T_State
-from nonebot.utils import run_sync
 from nonebot_plugin_alconna import (
     AlcMatches,
     Alconna,
+    AlconnaMatcher,
     Args,
     At,
     CommandMeta,
@@ -28,16 +32,110 @@ from nonebot_plugin_alconna.builtins.extensions.reply import ReplyMergeExtension
 from nonebot_plugin_alconna.uniseg.tools import image_fetch
 from nonebot_plugin_uninfo import Interface, QryItrface, Session, Uninfo, User
 
+from ..cache import (
+    avatar_cache,
+    avatar_key,
+    is_result_cacheable,
+    meme_result_key,
+    result_cache,
+    user_cache,
+)
 from ..config import memes_config
+from ..limiter import Overloaded, admission_controller
 from ..manager import meme_manager
-from ..recorder import record_meme_generation
-from ..utils import NetworkError
-from .utils import UserId
+from ..recorder import record_meme_generation, scope_value
+from ..render import RenderQueueFull, render_meme
+from ..utils import NetworkError, download_url, startup_phase
+from .utils import UserId, get_user_id
 
 alc_config.command_max_count += 1000
 
+MEME_KEY = "_memes_meme_key"
 
-async def process(
+
+class ImageFetchError(Exception):
+    def __init__(self, index: int, error: BaseException):
+        self.index = index
+        self.error = error
+
+
+async def fetch_image(
+    event: Event,
+    bot: Bot,
+    state: T_State,
+    image: Image,
+    cache_key: Optional[str] = None,
+) -> bytes:
+    """获取图片；传入 `cache_key` 时视为用户头像，直接下载并缓存"""
+    timeout = memes_config.memes_image_fetch_timeout
+    if cache_key and image.url:
+        if (result := await avatar_cache.get(cache_key)) is not None:
+            return result
+        result = await asyncio.wait_for(download_url(image.url), timeout=timeout)
+        await avatar_cache.set(cache_key, result)
+        return result
+
+    result = await asyncio.wait_for(
+        image_fetch(event, bot, state, image), timeout=timeout
+    )
+    if not isinstance(result, bytes):
+        raise NotImplementedError
+    return result
+
+
+async def fetch_images(
+    event: Event,
+    bot: Bot,
+    state: T_State,
+    images: list[Image],
+    cache_keys: list[Optional[str]],
+) -> list[bytes]:
+    """并发获取所有图片，出错时抛出 `ImageFetchError` 并指明出错的图片"""
+    if not images:
+        return []
+
+    tasks = [
+        asyncio.create_task(fetch_image(event, bot, state, image, cache_key))
+        for image, cache_key in zip(images, cache_keys)
+    ]
+    _, pending = await asyncio.wait(
+        tasks, timeout=memes_config.memes_image_fetch_deadline
+    )
+    for task in pending:
+        task.cancel()
+
+    errors: list[tuple[int, BaseException]] = []
+    for index, task in enumerate(tasks):
+        if task in pending:
+            errors.append((index, asyncio.TimeoutError()))
+        elif error := task.exception():
+            errors.append((index, error))
+    for index, error in errors:
+        if not isinstance(
+            error,
+            (NotImplementedError, NetworkError, AdapterException, asyncio.TimeoutError),
+        ):
+            raise error
+    if errors:
+        index, error = errors[0]
+        raise ImageFetchError(index, error) from error
+    return [task.result() for task in tasks]
+
+
+async def render_meme_result(
+    meme: Meme, images: list[bytes], texts: list[str], args: dict[str, Any]
+) -> bytes:
+    """制作表情，结果只由输入决定的表情优先使用缓存"""
+    if not is_result_cacheable(meme):
+        return (await render_meme(meme, images, texts, args)).getvalue()
+    cache_key = meme_result_key(meme, images, texts, args)
+    if (result := await result_cache.get(cache_key)) is None:
+        result = (await render_meme(meme, images, texts, args)).getvalue()
+        await result_cache.set(cache_key, result)
+    return result
+
+
+async def generate(
     bot: Bot,
     event: Event,
     state: T_State,
@@ -47,21 +145,30 @@ async def process(
     images: list[Image],
     texts: list[str],
     users: list[User],
-    args: dict[str, Any] = {},
-    show_info: bool = False,
-):
-    image_contents: list[bytes] = []
+    args: dict[str, Any],
+) -> bytes:
+    # 用户头像按用户 id 和头像链接缓存
+    avatar_users = {user.avatar: user.id for user in users if user.avatar}
+    cache_keys = [
+        avatar_key(
+            scope_value(session.scope),
+            session.self_id,
+            avatar_users[image.url],
+            image.url,
+        )
+        if image.url and image.url in avatar_users
+        else None
+        for image in images
+    ]
 
     try:
-        for image in images:
-            result = await image_fetch(event, bot, state, image)
-            if not isinstance(result, bytes):
-                raise NotImplementedError
-            image_contents.append(result)
-    except NotImplementedError:
-        await matcher.finish("当前平台可能不支持获取图片")
-    except (NetworkError, AdapterException):
+        image_contents = await fetch_images(event, bot, state, images, cache_keys)
+    except ImageFetchError as e:
+        if isinstance(e.error, NotImplementedError):
+            await matcher.finish("当前平台可能不支持获取图片")
         logger.warning(traceback.format_exc())
+        if len(images) > 1:
+            await matcher.finish(f"第 {e.index + 1} 张图片下载出错，请稍后再试")
         await matcher.finish("图片下载出错，请稍后再试")
 
     args_user_infos = []
@@ -74,10 +181,43 @@ async def process(
     args["user_infos"] = args_user_infos
 
     try:
-        result = await run_sync(meme)(images=image_contents, texts=texts, args=args)
+        result = await render_meme_result(meme, image_contents, texts, args)
         await record_meme_generation(session, meme.key)
     except MemeGeneratorException as e:
         await matcher.finish(e.message)
+    except RenderQueueFull:
+        await matcher.finish("当前表情制作任务过多，请稍后再试")
+
+    return result
+
+
+async def process(
+    bot: Bot,
+    event: Event,
+    state: T_State,
+    matcher: Matcher,
+    session: Session,
+    meme: Meme,
+    images: list[Image],
+    texts: list[str],
+    users: list[User],
+    args: dict[str, Any] = {},
+    show_info: bool = False,
+):
+    scene_id = get_user_id(session)
+    if memes_config.memes_overload_show_position and (
+        position := admission_controller.queue_position(scene_id)
+    ):
+        await matcher.send(f"当前表情制作请求较多，正在排队（第 {position} 位）")
+    try:
+        async with admission_controller.acquire(scene_id):
+            result = await generate(
+                bot, event, state, matcher, session, meme, images, texts, users, args
+            )
+    except Overloaded as e:
+        if e.timeout:
+            await matcher.finish("表情制作排队超时，请稍后再试")
+        await matcher.finish("当前表情制作请求过多，请稍后再试")
 
     msg = UniMessage()
     if show_info:
@@ -92,6 +232,38 @@ meme_params_key = "meme_params"
 arg_meme_params = Args[meme_params_key, MultiVar(T_MemeParams, "*")]
 
 
+async def get_user(
+    session: Session, interface: Interface, user_id: str, in_scene: bool
+) -> Optional[User]:
+    """获取用户信息，`in_scene` 为真时优先使用当前群聊中的成员信息"""
+    in_scene = in_scene and session.scene.type > 0
+    scope = scope_value(session.scope)
+    cache_key = (
+        (scope, session.self_id, session.scene.type, session.scene.id, user_id)
+        if in_scene
+        else (scope, session.self_id, user_id)
+    )
+    if user := user_cache.get(cache_key):
+        return copy(user)
+
+    user = None
+    if in_scene:
+        try:
+            if member := await interface.get_member(
+                session.scene.type, session.scene.id, user_id
+            ):
+                user = member.user
+                if member.nick:
+                    user.nick = member.nick
+        except (NotImplementedError, NetworkError, AdapterException):
+            pass
+    if not user:
+        user = await interface.get_user(user_id)
+    if user and user_cache.ttl:
+        user_cache.set(cache_key, copy(user))
+    return user
+
+
 async def handle_params(
     matcher: Matcher,
     session: Session,
@@ -102,31 +274,50 @@ async def handle_params(
     images: list[Image] = []
     users: list[User] = []
 
+    # 先并发获取所有提及的用户信息
+    lookups: dict[tuple[str, bool], Union[Optional[User], BaseException]] = {}
     for msg_seg in meme_params:
         if isinstance(msg_seg, At):
-            try:
-                user = None
-                if session.scene.type > 0:
-                    try:
-                        if member := await interface.get_member(
-                            session.scene.type, session.scene.id, msg_seg.target
-                        ):
-                            user = member.user
-                            if member.nick:
-                                user.nick = member.nick
-                    except (NotImplementedError, NetworkError, AdapterException):
-                        pass
-                if not user:
-                    user = await interface.get_user(msg_seg.target)
-                if user:
-                    if image_url := user.avatar:
-                        images.append(Image(url=image_url))
-                    users.append(user)
-            except NotImplementedError:
-                await matcher.finish("当前平台可能不支持获取用户信息")
-            except (NetworkError, AdapterException):
-                logger.warning(traceback.format_exc())
-                await matcher.finish("用户信息获取出错，请稍后再试")
+            lookups[(msg_seg.target, True)] = None
+        elif isinstance(msg_seg, Text):
+            text = msg_seg.text
+            if text.startswith("@") and (user_id := text[1:]):
+                lookups[(user_id, False)] = None
+    if lookups:
+        results = await asyncio.gather(
+            *(
+                get_user(session, interface, user_id, in_scene)
+                for user_id, in_scene in lookups
+            ),
+            return_exceptions=True,
+        )
+        lookups = dict(zip(lookups, results))
+
+    async def lookup_user(user_id: str, in_scene: bool, error_msg: str):
+        result = lookups[(user_id, in_scene)]
+        if isinstance(result, NotImplementedError):
+            await matcher.finish("当前平台可能不支持获取用户信息")
+        if isinstance(result, (NetworkError, AdapterException)):
+            logger.warning(
+                "".join(
+                    traceback.format_exception(
+                        type(result), result, result.__traceback__
+                    )
+                )
+            )
+            await matcher.finish(error_msg)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    for msg_seg in meme_params:
+        if isinstance(msg_seg, At):
+            if user := await lookup_user(
+                msg_seg.target, True, "用户信息获取出错，请稍后再试"
+            ):
+                if image_url := user.avatar:
+                    images.append(Image(url=image_url))
+                users.append(user)
 
         elif isinstance(msg_seg, Image):
             images.append(msg_seg)
@@ -134,16 +325,12 @@ async def handle_params(
         elif isinstance(msg_seg, Text):
             text = msg_seg.text
             if text.startswith("@") and (user_id := text[1:]):
-                try:
-                    if user := await interface.get_user(user_id):
-                        if image_url := user.avatar:
-                            images.append(Image(url=image_url))
-                        users.append(user)
-                except NotImplementedError:
-                    await matcher.finish("当前平台可能不支持获取用户信息")
-                except (NetworkError, AdapterException):
-                    logger.warning(traceback.format_exc())
-                    await matcher.finish("用户信息获取出错，请检查用户 id 或稍后再试")
+                if user := await lookup_user(
+                    user_id, False, "用户信息获取出错，请检查用户 id 或稍后再试"
+                ):
+                    if image_url := user.avatar:
+                        images.append(Image(url=image_url))
+                    users.append(user)
 
             elif text == "自己":
                 user = session.user
@@ -164,7 +351,7 @@ if (meme_prefixes := memes_config.memes_command_prefixes) is not None:
     prefixes = meme_prefixes
 
 
-def create_matcher(meme: Meme):
+def create_meme_command(meme: Meme) -> Alconna:
     options = [
         opt.option()
         for opt in (
@@ -173,18 +360,132 @@ def create_matcher(meme: Meme):
             else []
         )
     ]
+    return Alconna(
+        prefixes,
+        meme.keywords[0],
+        *options,
+        arg_meme_params,
+        meta=CommandMeta(keep_crlf=True),
+    )
+
+
+async def handle_meme(
+    bot: Bot,
+    event: Event,
+    state: T_State,
+    matcher: Matcher,
+    user_id: str,
+    session: Session,
+    interface: Interface,
+    meme: Meme,
+    alc_matches: Arparma,
+):
+    if not meme_manager.check(user_id, meme.key):
+        logger.info(f"用户 {user_id} 表情 {meme.key} 被禁用")
+        return
+
+    args: dict[str, Any] = {}
+    options = alc_matches.options
+    for option, option_result in options.items():
+        if option_result.value is None:
+            args.update(option_result.args)
+        else:
+            args[option] = option_result.value
+
+    meme_params: list[T_MemeParams] = list(alc_matches.query(meme_params_key, ()))
+    texts, images, users = await handle_params(matcher, session, interface, meme_params)
+
+    # 当所需图片数为 2 且已指定图片数为 1 时，使用发送者的头像作为第一张图
+    if meme.params_type.min_images == 2 and len(images) == 1:
+        user = session.user
+        if image_url := user.avatar:
+            images.insert(0, Image(url=image_url))
+        if (member := session.member) and member.nick:
+            user.nick = member.nick
+        users.insert(0, user)
+
+    # 当所需图片数为 1 且没有已指定图片时，使用发送者的头像
+    if memes_config.memes_use_sender_when_no_image and (
+        meme.params_type.min_images == 1 and len(images) == 0
+    ):
+        user = session.user
+        if image_url := user.avatar:
+            images.append(Image(url=image_url))
+        if (member := session.member) and member.nick:
+            user.nick = member.nick
+        users.append(user)
+
+    # 当所需文字数 >0 且没有输入文字时，使用默认文字
+    if memes_config.memes_use_default_when_no_text and (
+        meme.params_type.min_texts > 0 and len(texts) == 0
+    ):
+        texts = meme.params_type.default_texts
+
+    async def finish(msg: str) -> NoReturn:
+        logger.info(msg)
+        if memes_config.memes_prompt_params_error:
+            matcher.stop_propagation()
+            await matcher.finish(msg)
+        await matcher.finish()
+
+    if not (meme.params_type.min_images <= len(images) <= meme.params_type.max_images):
+        await finish(
+            f"输入图片数量不符，图片数量应为 {meme.params_type.min_images}"
+            + (
+                f" ~ {meme.params_type.max_images}"
+                if meme.params_type.max_images > meme.params_type.min_images
+                else ""
+            )
+        )
+    if not (meme.params_type.min_texts <= len(texts) <= meme.params_type.max_texts):
+        await finish(
+            f"输入文字数量不符，文字数量应为 {meme.params_type.min_texts}"
+            + (
+                f" ~ {meme.params_type.max_texts}"
+                if meme.params_type.max_texts > meme.params_type.min_texts
+                else ""
+            )
+        )
+
+    matcher.stop_propagation()
+    await process(bot, event, state, matcher, session, meme, images, texts, users, args)
+
+
+async def handle_meme_matcher(
+    bot: Bot,
+    event: Event,
+    state: T_State,
+    matcher: Matcher,
+    user_id: UserId,
+    session: Uninfo,
+    interface: QryItrface,
+    alc_matches: AlcMatches,
+):
+    if not (meme := meme_manager.get_meme(state[MEME_KEY])):
+        return
+    await handle_meme(
+        bot, event, state, matcher, user_id, session, interface, meme, alc_matches
+    )
+
+
+# 所有表情响应器共用同一个处理函数，只解析一次依赖
+meme_handler = Dependent[Any].parse(
+    call=handle_meme_matcher, allow_types=AlconnaMatcher.HANDLER_PARAM_TYPES
+)
+
+
+meme_matchers: dict[str, type[AlconnaMatcher]] = {}
+
+
+def create_matcher(meme: Meme):
     meme_matcher = on_alconna(
-        Alconna(
-            prefixes,
-            meme.keywords[0],
-            *options,
-            arg_meme_params,
-            meta=CommandMeta(keep_crlf=True),
-        ),
+        create_meme_command(meme),
         aliases=set(meme.keywords[1:]),
         block=False,
         priority=12,
         extensions=[ReplyMergeExtension()],
+        handlers=[meme_handler],
+        default_state={MEME_KEY: meme.key},
     )
     for shortcut in meme.shortcuts:
         meme_matcher.shortcut(
@@ -193,93 +494,12 @@ def create_matcher(meme: Meme):
             prefix=True,
             humanized=shortcut.humanized,
         )
+    meme_matchers[meme.key] = meme_matcher
 
-    @meme_matcher.handle()
-    async def _(
-        bot: Bot,
-        event: Event,
-        state: T_State,
-        matcher: Matcher,
-        user_id: UserId,
-        session: Uninfo,
-        interface: QryItrface,
-        alc_matches: AlcMatches,
-    ):
-        if not meme_manager.check(user_id, meme.key):
-            logger.info(f"用户 {user_id} 表情 {meme.key} 被禁用")
-            return
-
-        args: dict[str, Any] = {}
-        options = alc_matches.options
-        for option, option_result in options.items():
-            if option_result.value is None:
-                args.update(option_result.args)
-            else:
-                args[option] = option_result.value
-
-        meme_params: list[T_MemeParams] = list(alc_matches.query(meme_params_key, ()))
-        texts, images, users = await handle_params(
-            matcher, session, interface, meme_params
-        )
-
-        # 当所需图片数为 2 且已指定图片数为 1 时，使用发送者的头像作为第一张图
-        if meme.params_type.min_images == 2 and len(images) == 1:
-            user = session.user
-            if image_url := user.avatar:
-                images.insert(0, Image(url=image_url))
-            if (member := session.member) and member.nick:
-                user.nick = member.nick
-            users.insert(0, user)
-
-        # 当所需图片数为 1 且没有已指定图片时，使用发送者的头像
-        if memes_config.memes_use_sender_when_no_image and (
-            meme.params_type.min_images == 1 and len(images) == 0
-        ):
-            user = session.user
-            if image_url := user.avatar:
-                images.append(Image(url=image_url))
-            if (member := session.member) and member.nick:
-                user.nick = member.nick
-            users.append(user)
-
-        # 当所需文字数 >0 且没有输入文字时，使用默认文字
-        if memes_config.memes_use_default_when_no_text and (
-            meme.params_type.min_texts > 0 and len(texts) == 0
-        ):
-            texts = meme.params_type.default_texts
-
-        async def finish(msg: str) -> NoReturn:
-            logger.info(msg)
-            if memes_config.memes_prompt_params_error:
-                matcher.stop_propagation()
-                await matcher.finish(msg)
-            await matcher.finish()
 
-        if not (
-            meme.params_type.min_images <= len(images) <= meme.params_type.max_images
-        ):
-            await finish(
-                f"输入图片数量不符，图片数量应为 {meme.params_type.min_images}"
-                + (
-                    f" ~ {meme.params_type.max_images}"
-                    if meme.params_type.max_images > meme.params_type.min_images
-                    else ""
-                )
-            )
-        if not (meme.params_type.min_texts <= len(texts) <= meme.params_type.max_texts):
-            await finish(
-                f"输入文字数量不符，文字数量应为 {meme.params_type.min_texts}"
-                + (
-                    f" ~ {meme.params_type.max_texts}"
-                    if meme.params_type.max_texts > meme.params_type.min_texts
-                    else ""
-                )
-            )
-
-        matcher.stop_propagation()
-        await process(
-            bot, event, state, matcher, session, meme, images, texts, users, args
-        )
+def remove_matcher(meme_key: str):
+    if meme_matcher := meme_matchers.pop(meme_key, None):
+        meme_matcher.clean()
 
 
 def create_matchers():
@@ -287,7 +507,10 @@ def create_matchers():
         create_matcher(meme)
 
 
-create_matchers()
+# 使用关键词前缀树分发时，不为每个表情单独创建响应器
+if memes_config.memes_dispatch_mode == "matcher":
+    with startup_phase("创建表情响应器"):
+        create_matchers()
 
 
 random_matcher = on_alconna(
@@ -313,10 +536,11 @@ async def _(
     meme_params: list[T_MemeParams] = list(alc_matches.query(meme_params_key, ()))
     texts, images, users = await handle_params(matcher, session, interface, meme_params)
 
+    allowed_memes = meme_manager.allowed_memes(user_id)
     available_memes = [
         meme
         for meme in meme_manager.get_memes()
-        if meme_manager.check(user_id, meme.key)
+        if meme.key in allowed_memes
         and (
             (meme.params_type.min_images <= len(images) <= meme.params_type.max_images)
             and (meme.params_type.min_texts <= len(texts) <= meme.params_type.max_texts)
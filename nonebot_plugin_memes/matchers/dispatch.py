@@ -0,0 +1,207 @@
+import re
+from collections.abc import Iterable
+from typing import Optional
+
+from meme_generator import Meme
+from nonebot import on_message
+from nonebot.adapters import Bot, Event
+from nonebot.matcher import Matcher
+from nonebot.typing import T_State
+from nonebot_plugin_alconna import AlconnaRule
+from nonebot_plugin_alconna.builtins.extensions.reply import ReplyMergeExtension
+from nonebot_plugin_alconna.consts import ALCONNA_RESULT
+from nonebot_plugin_alconna.extension import ExtensionExecutor
+from nonebot_plugin_alconna.model import CommandResult
+from nonebot_plugin_uninfo import QryItrface, Uninfo
+
+from ..config import memes_config
+from ..manager import meme_manager
+from .command import MEME_KEY, create_meme_command, handle_meme, prefixes
+from .utils import UserId
+
+REGEX_META_CHARS = set(".^$*+?{}[]\\|()")
+
+
+def literal_prefix(pattern: str) -> str:
+    """正则表达式开头的固定文本，无法确定时返回空字符串"""
+    if has_top_level_alternation(pattern):
+        # 存在多个分支时开头不唯一
+        return ""
+    prefix = ""
+    for char in pattern:
+        if char in REGEX_META_CHARS:
+            # 量词可能使前一个字符不出现
+            if char in "*?{":
+                prefix = prefix[:-1]
+            break
+        prefix += char
+    return prefix
+
+
+def has_top_level_alternation(pattern: str) -> bool:
+    """正则表达式中是否有不在括号或字符集中的 `|`"""
+    depth = 0
+    class_start: Optional[int] = None
+    escaped = False
+    for i, char in enumerate(pattern):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif class_start is not None:
+            # 字符集开头的 `]` 是普通字符
+            if char == "]" and i > class_start:
+                class_start = None
+        elif char == "[":
+            class_start = i + 2 if pattern[i + 1 : i + 2] == "^" else i + 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif char == "|" and depth == 0:
+            return True
+    return False
+
+
+class TrieNode:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: dict[str, TrieNode] = {}
+        self.values: list[str] = []
+
+
+class MemeTrie:
+    """表情关键词前缀树
+
+    由关键词和快捷指令的固定开头构建，用于在 O(消息长度) 内找出可能匹配的表情；
+    开头不固定的快捷指令单独使用正则表达式检查
+    """
+
+    def __init__(self, memes: list[Meme]):
+        self.root = TrieNode()
+        self.patterns: list[tuple[re.Pattern[str], str]] = []
+        for meme in memes:
+            for keyword in meme.keywords:
+                self.add(keyword, meme.key)
+            for shortcut in meme.shortcuts:
+                if prefix := literal_prefix(shortcut.key):
+                    self.add(prefix, meme.key)
+                else:
+                    self.patterns.append((re.compile(shortcut.key), meme.key))
+
+    def add(self, word: str, meme_key: str):
+        node = self.root
+        for char in word:
+            node = node.children.setdefault(char, TrieNode())
+        if meme_key not in node.values:
+            node.values.append(meme_key)
+
+    def match(self, text: str) -> list[str]:
+        """返回可能匹配的表情名，较长的关键词在前"""
+        matched: list[str] = []
+        node = self.root
+        for char in text:
+            if not (node := node.children.get(char)):
+                break
+            matched[:0] = node.values
+        for pattern, meme_key in self.patterns:
+            if pattern.match(text):
+                matched.append(meme_key)
+        return list(dict.fromkeys(matched))
+
+
+_trie: Optional[MemeTrie] = None
+_meme_rules: dict[str, AlconnaRule] = {}
+
+
+def get_trie() -> MemeTrie:
+    global _trie
+    if _trie is None:
+        _trie = MemeTrie(meme_manager.get_memes())
+    return _trie
+
+
+def reset_trie(meme_keys: Iterable[str] = ()):
+    """表情列表变化后重建前缀树，并移除有变化的表情对应的规则"""
+    global _trie
+    _trie = None
+    for meme_key in meme_keys:
+        if rule := _meme_rules.pop(meme_key, None):
+            rule.executor.destroy()
+            rule.destroy()
+
+
+def find_memes(text: str) -> list[str]:
+    text = text.lstrip()
+    meme_keys: list[str] = []
+    for prefix in prefixes or [""]:
+        if text.startswith(prefix):
+            meme_keys.extend(get_trie().match(text[len(prefix) :]))
+    return list(dict.fromkeys(meme_keys))
+
+
+def get_meme_rule(meme: Meme) -> AlconnaRule:
+    """获取表情对应的 Alconna 规则，在第一次使用时创建"""
+    if rule := _meme_rules.get(meme.key):
+        return rule
+    command = create_meme_command(meme)
+    for shortcut in meme.shortcuts:
+        command.shortcut(
+            shortcut.key,
+            arguments=shortcut.args,
+            prefix=True,
+            humanized=shortcut.humanized,
+        )
+    rule = AlconnaRule(command, _aliases=set(meme.keywords[1:]))
+    rule.executor = ExtensionExecutor(rule, [ReplyMergeExtension()])
+    rule.executor.post_init(command)
+    _meme_rules[meme.key] = rule
+    return rule
+
+
+async def dispatch_rule(bot: Bot, event: Event, state: T_State) -> bool:
+    if event.get_type() != "message":
+        return False
+    try:
+        text = event.get_plaintext()
+    except Exception:
+        return False
+    # 只解析前缀树中找到的表情，不再逐个尝试全部表情
+    for meme_key in find_memes(text):
+        if not (meme := meme_manager.get_meme(meme_key)):
+            continue
+        if await get_meme_rule(meme)(bot, event, state):
+            state[MEME_KEY] = meme.key
+            return True
+    return False
+
+
+if memes_config.memes_dispatch_mode == "trie":
+    dispatch_matcher = on_message(rule=dispatch_rule, block=False, priority=12)
+
+    @dispatch_matcher.handle()
+    async def _(
+        bot: Bot,
+        event: Event,
+        state: T_State,
+        matcher: Matcher,
+        user_id: UserId,
+        session: Uninfo,
+        interface: QryItrface,
+    ):
+        meme = meme_manager.get_meme(state[MEME_KEY])
+        result: CommandResult = state[ALCONNA_RESULT]
+        if not meme:
+            return
+        await handle_meme(
+            bot,
+            event,
+            state,
+            matcher,
+            user_id,
+            session,
+            interface,
+            meme,
+            result.result,
+        )
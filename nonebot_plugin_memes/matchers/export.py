@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from nonebot.log import logger
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER
+from nonebot_plugin_alconna import (
+    Alconna,
+    AlconnaQuery,
+    Args,
+    Option,
+    Query,
+    on_alconna,
+)
+
+from ..export import export_meme_generation_records
+from .utils import find_meme
+
+export_matcher = on_alconna(
+    Alconna(
+        "导出表情调用记录",
+        Args["meme_name?", str],
+        Option("-f|--format", Args["format", ["csv", "jsonl"]], help_text="导出格式"),
+        Option("-d|--days", Args["days", int], help_text="导出最近几天的记录"),
+    ),
+    block=True,
+    priority=11,
+    use_cmd_start=True,
+    permission=SUPERUSER,
+)
+
+_export_lock = asyncio.Lock()
+
+
+@export_matcher.handle()
+async def _(
+    matcher: Matcher,
+    meme_name: Optional[str] = None,
+    query_format: Query[str] = AlconnaQuery("format", "csv"),
+    query_days: Query[int] = AlconnaQuery("days", 0),
+):
+    meme = await find_meme(matcher, meme_name) if meme_name else None
+    time_start = (
+        datetime.now(timezone.utc) - timedelta(days=query_days.result)
+        if query_days.result > 0
+        else None
+    )
+
+    if _export_lock.locked():
+        await matcher.finish("已有正在进行的导出任务，请稍后再试")
+
+    async with _export_lock:
+        await matcher.send("正在导出表情调用记录，请稍候...")
+        try:
+            path, count = await export_meme_generation_records(
+                "jsonl" if query_format.result == "jsonl" else "csv",
+                meme_key=meme.key if meme else None,
+                time_start=time_start,
+            )
+        except Exception as e:
+            logger.warning(f"表情调用记录导出失败：{e!r}")
+            await matcher.finish("表情调用记录导出失败")
+
+    await matcher.finish(f"表情调用记录导出完成，共 {count} 条，已保存至：{path}")
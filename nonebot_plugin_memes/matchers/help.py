@@ -1,22 +1,82 @@
+import asyncio
 import hashlib
+import time
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from itertools import chain
 
 from meme_generator import Meme
 from meme_generator.utils import MemeProperties, render_meme_list
+from nonebot.log import logger
 from nonebot.utils import run_sync
 from nonebot_plugin_alconna import Image, Text, on_alconna
-from nonebot_plugin_localstore import get_cache_dir
-from nonebot_plugin_uninfo import Uninfo
+from nonebot_plugin_uninfo import Session, Uninfo
 from pypinyin import Style, pinyin
 
+from ..cache import memes_cache_dir
 from ..config import memes_config
 from ..manager import meme_manager
-from ..recorder import SessionIdType, get_meme_generation_keys
+from ..recorder import (
+    SessionIdType,
+    get_meme_generation_key_counts,
+    scope_value,
+    truncate_time,
+)
 from .utils import UserId
 
-memes_cache_dir = get_cache_dir("nonebot_plugin_memes")
+# 热门表情缓存的刷新间隔，单位：秒
+HOT_MEMES_REFRESH_INTERVAL = 300
+_hot_memes: dict[tuple[str, str], tuple[float, set[str]]] = {}
+_hot_memes_refreshing: set[tuple[str, str]] = set()
+_hot_memes_tasks: set[asyncio.Task] = set()
+
+
+async def query_hot_memes(session: Session) -> set[str]:
+    list_image_config = memes_config.memes_list_image_config
+    # 起始时间取整到小时，以便从汇总表中查询
+    precision = timedelta(hours=1)
+    time_start = truncate_time(
+        datetime.now(timezone.utc) - timedelta(days=list_image_config.label_hot_days),
+        precision,
+    )
+    key_counts = await get_meme_generation_key_counts(
+        session, SessionIdType.GLOBAL, time_start=time_start, precision=precision
+    )
+    return {
+        key
+        for key, count in key_counts.items()
+        if count >= list_image_config.label_hot_threshold
+    }
+
+
+async def refresh_hot_memes(session: Session):
+    bot_key = (scope_value(session.scope), session.self_id)
+    _hot_memes_refreshing.add(bot_key)
+    try:
+        _hot_memes[bot_key] = (time.monotonic(), await query_hot_memes(session))
+    except Exception:
+        logger.exception("热门表情查询失败")
+    finally:
+        _hot_memes_refreshing.discard(bot_key)
+
+
+async def get_hot_memes(session: Session) -> set[str]:
+    """获取热门表情，缓存过期时在后台刷新并先返回旧的结果"""
+    bot_key = (scope_value(session.scope), session.self_id)
+    if bot_key not in _hot_memes:
+        await refresh_hot_memes(session)
+        if bot_key not in _hot_memes:
+            return set()
+    updated_time, hot_memes = _hot_memes[bot_key]
+    if (
+        time.monotonic() - updated_time > HOT_MEMES_REFRESH_INTERVAL
+        and bot_key not in _hot_memes_refreshing
+    ):
+        task = asyncio.create_task(refresh_hot_memes(session))
+        _hot_memes_tasks.add(task)
+        task.add_done_callback(_hot_memes_tasks.discard)
+    return hot_memes
+
 
 help_matcher = on_alconna(
     "表情包制作",
@@ -50,23 +110,17 @@ async def _(user_id: UserId, session: Uninfo):
         memes = sorted(memes, key=lambda meme: meme.date_modified, reverse=sort_reverse)
 
     label_new_timedelta = list_image_config.label_new_timedelta
-    label_hot_threshold = list_image_config.label_hot_threshold
-    label_hot_days = list_image_config.label_hot_days
-
-    meme_generation_keys = await get_meme_generation_keys(
-        session,
-        SessionIdType.GLOBAL,
-        time_start=datetime.now(timezone.utc) - timedelta(days=label_hot_days),
-    )
+    hot_memes = await get_hot_memes(session)
+    allowed_memes = meme_manager.allowed_memes(user_id)
 
     meme_list: list[tuple[Meme, MemeProperties]] = []
     for meme in memes:
         labels = []
         if datetime.now() - meme.date_created < label_new_timedelta:
             labels.append("new")
-        if meme_generation_keys.count(meme.key) >= label_hot_threshold:
+        if meme.key in hot_memes:
             labels.append("hot")
-        disabled = not meme_manager.check(user_id, meme.key)
+        disabled = meme.key not in allowed_memes
         meme_list.append((meme, MemeProperties(disabled=disabled, labels=labels)))
 
     # cache rendered meme list
@@ -1,8 +1,8 @@
 from arclet.alconna import TextFormatter
 from nonebot.matcher import Matcher
-from nonebot.utils import run_sync
 from nonebot_plugin_alconna import Alconna, Args, Image, Text, on_alconna
 
+from ..preview import get_meme_preview
 from .utils import find_meme
 
 info_matcher = on_alconna(
@@ -60,5 +60,5 @@ async def _(matcher: Matcher, meme_name: str):
         + (f"\n可选参数：{args_info}" if args_info else "")
     )
     info += "\n表情预览：\n"
-    img = await run_sync(meme.generate_preview)()
+    img = await get_meme_preview(meme)
     await (Text(info) + Image(raw=img)).finish()
@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Union
+
+from nonebot.matcher import Matcher
+from nonebot_plugin_alconna import (
+    Alconna,
+    AlconnaQuery,
+    Args,
+    Option,
+    Query,
+    on_alconna,
+    store_true,
+)
+from nonebot_plugin_uninfo import Interface, QryItrface, SceneType, Session, Uninfo
+
+from ..manager import meme_manager
+from ..recorder import (
+    SessionIdType,
+    get_meme_generation_top_scenes,
+    get_meme_generation_top_users,
+    truncate_time,
+)
+from .command import get_user
+from .utils import find_meme
+
+LEADERBOARD_SIZE = 10
+
+leaderboard_matcher = on_alconna(
+    Alconna(
+        "表情调用排行",
+        Args["meme_name?", str],
+        Option("-g|--global", default=False, action=store_true, help_text="群聊排行"),
+        Option(
+            "-t|--type",
+            Args["type", ["24h", "7d", "30d", "1y", "all"]],
+            help_text="统计类型",
+        ),
+    ),
+    aliases={"表情使用排行"},
+    block=True,
+    priority=11,
+    use_cmd_start=True,
+)
+
+
+def wrapper(
+    slot: Union[int, str], content: Optional[str], context: dict[str, Any]
+) -> str:
+    if slot == "global" and content:
+        return "--global"
+    elif slot == "type" and content:
+        if content in ["日", "24小时", "1天"]:
+            return "--type 24h"
+        elif content in ["周", "一周", "7天"]:
+            return "--type 7d"
+        elif content in ["月", "30天"]:
+            return "--type 30d"
+        elif content in ["年", "一年"]:
+            return "--type 1y"
+    return ""
+
+
+pattern_type = r"(?P<type>日|24小时|1天|周|一周|7天|月|30天|年|一年)"
+pattern_global = r"(?P<global>全局)"
+pattern_cmd = r"表情(?:调用|使用)排行"
+
+leaderboard_matcher.shortcut(
+    rf"{pattern_global}?{pattern_type}?{pattern_cmd}",
+    prefix=True,
+    wrapper=wrapper,
+    arguments=["{global}", "{type}"],
+)
+
+
+async def get_user_name(session: Session, interface: Interface, user_id: str) -> str:
+    try:
+        if user := await get_user(session, interface, user_id, in_scene=True):
+            return user.nick or user.name or user_id
+    except Exception:
+        pass
+    return user_id
+
+
+async def get_scene_name(
+    interface: Interface, scene_type: SceneType, scene_id: str
+) -> str:
+    try:
+        if scene := await interface.get_scene(scene_type, scene_id):
+            return scene.name or scene_id
+    except Exception:
+        pass
+    return scene_id
+
+
+@leaderboard_matcher.handle()
+async def _(
+    matcher: Matcher,
+    session: Uninfo,
+    interface: QryItrface,
+    meme_name: Optional[str] = None,
+    query_global: Query[bool] = AlconnaQuery("global.value", False),
+    query_type: Query[str] = AlconnaQuery("type", "all"),
+):
+    meme = await find_meme(matcher, meme_name) if meme_name else None
+
+    is_global = query_global.result
+    type = query_type.result
+    if not is_global and session.scene.is_private:
+        await matcher.finish("请在群聊中使用，或发送 “全局表情调用排行” 查看群聊排行")
+
+    # 开始时间取整到小时，以便从汇总表中查询
+    now = datetime.now(timezone.utc)
+    precision = timedelta(hours=1)
+    time_start: Optional[datetime] = None
+    if type == "24h":
+        time_start = truncate_time(now - timedelta(days=1), precision)
+        humanized = "24小时"
+    elif type == "7d":
+        time_start = truncate_time(now - timedelta(days=7), precision)
+        humanized = "7天"
+    elif type == "30d":
+        time_start = truncate_time(now - timedelta(days=30), precision)
+        humanized = "30天"
+    elif type == "1y":
+        time_start = truncate_time(now - timedelta(days=365), precision)
+        humanized = "一年"
+    else:
+        precision = timedelta(days=1)
+        humanized = ""
+
+    meme_keys = [meme.key] if meme else [m.key for m in meme_manager.get_memes()]
+    meme_desc = f"表情“{'/'.join(meme.keywords)}”" if meme else "表情"
+
+    if is_global:
+        scenes = await get_meme_generation_top_scenes(
+            session,
+            SessionIdType.GLOBAL,
+            meme_keys=meme_keys,
+            time_start=time_start,
+            precision=precision,
+            limit=LEADERBOARD_SIZE,
+        )
+        names = await asyncio.gather(
+            *(
+                get_scene_name(interface, scene_type, scene_id)
+                for scene_type, scene_id, _ in scenes
+            )
+        )
+        counts = [count for _, _, count in scenes]
+        title = f"{humanized}{meme_desc}调用次数最多的群聊："
+    else:
+        users = await get_meme_generation_top_users(
+            session,
+            SessionIdType.GROUP,
+            meme_keys=meme_keys,
+            time_start=time_start,
+            precision=precision,
+            limit=LEADERBOARD_SIZE,
+        )
+        names = await asyncio.gather(
+            *(get_user_name(session, interface, user_id) for user_id, _ in users)
+        )
+        counts = [count for _, count in users]
+        title = f"本群{humanized}{meme_desc}调用次数最多的用户："
+
+    if not counts:
+        await matcher.finish("暂时没有表情调用记录")
+
+    lines = [title]
+    for index, (name, count) in enumerate(zip(names, counts), start=1):
+        lines.append(f"{index}. {name}：{count} 次")
+    await matcher.finish("\n".join(lines))
@@ -1,9 +1,20 @@
+import asyncio
+from typing import Optional
+
+from nonebot.log import logger
 from nonebot.matcher import Matcher
 from nonebot.permission import SUPERUSER, Permission
+from nonebot.utils import run_sync
 from nonebot_plugin_alconna import Alconna, Args, on_alconna
 from nonebot_plugin_uninfo import Uninfo
 
-from ..manager import MemeMode, meme_manager
+from ..cache import meme_versions
+from ..config import memes_config
+from ..manager import MemeDiff, MemeMode, load_new_memes, meme_manager
+from ..preview import remove_preview
+from ..render import shutdown_executor, use_process_pool
+from .command import create_matcher, remove_matcher
+from .dispatch import reset_trie
 from .utils import UserId, find_meme
 
 
@@ -46,30 +57,92 @@ unblock_gl_matcher = on_alconna(
     permission=PERM_GLOBAL,
 )
 
+reload_matcher = on_alconna(
+    "重载表情",
+    block=True,
+    priority=11,
+    use_cmd_start=True,
+    permission=SUPERUSER,
+)
+
+_reload_lock: Optional[asyncio.Lock] = None
+
+
+async def reload_memes(load_dirs: bool = True) -> MemeDiff:
+    """重新加载表情列表，只更新有变化的表情对应的响应器和缓存
+
+    `load_dirs` 为 `True` 时先从 meme-generator 配置的额外表情目录中
+    加载新增或修改过的表情
+    """
+    global _reload_lock
+    if _reload_lock is None:
+        _reload_lock = asyncio.Lock()
+
+    async with _reload_lock:
+        if load_dirs:
+            await run_sync(load_new_memes)()
+        diff = await meme_manager.reload()
+        changed = diff.removed + diff.updated
+        if memes_config.memes_dispatch_mode == "matcher":
+            for meme_key in changed:
+                remove_matcher(meme_key)
+            for meme_key in diff.added + diff.updated:
+                if meme := meme_manager.get_meme(meme_key):
+                    create_matcher(meme)
+        elif diff.changed:
+            reset_trie(changed)
+        for meme_key in changed:
+            meme_versions[meme_key] += 1
+            await remove_preview(meme_key)
+        # 渲染进程中的表情列表在进程启动时加载，关闭进程池以便按新的表情列表重新启动；
+        # 已提交的任务仍在原来的进程中完成
+        if diff.changed and use_process_pool():
+            shutdown_executor(cancel_futures=False)
+        return diff
+
 
 @block_matcher.handle()
 async def _(matcher: Matcher, user_id: UserId, meme_name: str):
     meme = await find_meme(matcher, meme_name)
-    meme_manager.block(user_id, meme.key)
+    await meme_manager.block(user_id, meme.key)
     await matcher.finish(f"表情 {meme.key} 禁用成功")
 
 
 @unblock_matcher.handle()
 async def _(matcher: Matcher, user_id: UserId, meme_name: str):
     meme = await find_meme(matcher, meme_name)
-    meme_manager.unblock(user_id, meme.key)
+    await meme_manager.unblock(user_id, meme.key)
     await matcher.finish(f"表情 {meme.key} 启用成功")
 
 
 @block_gl_matcher.handle()
 async def _(matcher: Matcher, meme_name: str):
     meme = await find_meme(matcher, meme_name)
-    meme_manager.change_mode(MemeMode.WHITE, meme.key)
+    await meme_manager.change_mode(MemeMode.WHITE, meme.key)
     await matcher.finish(f"表情 {meme.key} 已设为白名单模式")
 
 
 @unblock_gl_matcher.handle()
 async def _(matcher: Matcher, meme_name: str):
     meme = await find_meme(matcher, meme_name)
-    meme_manager.change_mode(MemeMode.BLACK, meme.key)
+    await meme_manager.change_mode(MemeMode.BLACK, meme.key)
     await matcher.finish(f"表情 {meme.key} 已设为黑名单模式")
+
+
+@reload_matcher.handle()
+async def _(matcher: Matcher):
+    try:
+        diff = await reload_memes()
+    except Exception as e:
+        logger.warning(f"表情重载失败：{e!r}")
+        await matcher.finish("表情重载失败")
+
+    if not diff.changed:
+        await matcher.finish("表情列表没有变化")
+    logger.info(
+        f"表情重载完成，新增：{diff.added}，移除：{diff.removed}，更新：{diff.updated}"
+    )
+    await matcher.finish(
+        f"表情重载完成，新增 {len(diff.added)} 个，"
+        f"移除 {len(diff.removed)} 个，更新 {len(diff.updated)} 个"
+    )
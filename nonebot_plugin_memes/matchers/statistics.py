@@ -15,14 +15,17 @@ from nonebot_plugin_alconna import (
 )
 from nonebot_plugin_uninfo import Uninfo
 
+from ..cache import statistics_cache
 from ..manager import meme_manager
 from ..plot import plot_duration_counts, plot_meme_and_duration_counts
 from ..recorder import (
     SessionIdType,
-    get_meme_generation_records,
-    get_meme_generation_times,
+    get_meme_generation_duration_counts,
+    get_meme_generation_key_counts,
+    record_version,
+    session_scope_key,
 )
-from ..utils import add_timezone
+from ..render import RenderQueueFull
 from .utils import find_meme
 
 statistics_matcher = on_alconna(
@@ -99,6 +102,13 @@ statistics_matcher.shortcut(
 )
 
 
+def align_time(time: datetime, td: Union[timedelta, relativedelta]) -> datetime:
+    """将时间向下取整到所在时段的开始时间"""
+    if isinstance(td, relativedelta):
+        return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return time - (time - time.replace(hour=0, minute=0, second=0, microsecond=0)) % td
+
+
 @statistics_matcher.handle()
 async def _(
     matcher: Matcher,
@@ -124,6 +134,8 @@ async def _(
         id_type = SessionIdType.GROUP
 
     now = datetime.now().astimezone()
+    # 统计时段与整点对齐时，只需要对应精度的记录，可以从汇总表中查询
+    precision: Optional[timedelta] = None
     if type == "24h":
         start = now - timedelta(days=1)
         td = timedelta(hours=1)
@@ -134,6 +146,7 @@ async def _(
         td = timedelta(hours=1)
         fmt = "%H:%M"
         humanized = "本日"
+        precision = timedelta(hours=1)
     elif type == "7d":
         start = now - timedelta(days=7)
         td = timedelta(days=1)
@@ -146,6 +159,7 @@ async def _(
         td = timedelta(days=1)
         fmt = "%a"
         humanized = "本周"
+        precision = timedelta(days=1)
     elif type == "30d":
         start = now - timedelta(days=30)
         td = timedelta(days=1)
@@ -156,6 +170,7 @@ async def _(
         td = timedelta(days=1)
         fmt = "%m/%d"
         humanized = "本月"
+        precision = timedelta(days=1)
     elif type == "1y":
         start = now - relativedelta(years=1)
         td = relativedelta(months=1)
@@ -166,53 +181,44 @@ async def _(
         td = relativedelta(months=1)
         fmt = "%b"
         humanized = "本年"
-
-    if meme:
-        meme_times = await get_meme_generation_times(
-            session, id_type, meme_key=meme.key, time_start=start
-        )
-        meme_keys = [meme.key] * len(meme_times)
-    else:
-        meme_records = await get_meme_generation_records(
-            session, id_type, time_start=start
-        )
-        meme_records = [
-            record for record in meme_records if meme_manager.get_meme(record.meme_key)
-        ]
-        meme_times = [record.time for record in meme_records]
-        meme_keys = [record.meme_key for record in meme_records]
-
-    if not meme_times:
+        precision = timedelta(days=1)
+
+    # 同一时段内、且没有新的调用记录时，直接使用缓存的统计图
+    cache_key = (
+        *session_scope_key(session, id_type),
+        meme.key if meme else "",
+        type,
+        align_time(now, td),
+        record_version(session, id_type),
+    )
+    if cached := statistics_cache.get(cache_key):
+        await UniMessage.image(raw=cached).finish()
+
+    meme_keys = [meme.key] if meme else [m.key for m in meme_manager.get_memes()]
+    key_counts = await get_meme_generation_key_counts(
+        session, id_type, meme_keys=meme_keys, time_start=start, precision=precision
+    )
+
+    if not key_counts:
         await matcher.finish("暂时没有表情调用记录")
 
-    meme_times = [add_timezone(time) for time in meme_times]
-    meme_times.sort()
-
     def fmt_time(time: datetime) -> str:
         if type in ["24h", "7d", "30d", "1y"]:
             return (time + td).strftime(fmt)
         return time.strftime(fmt)
 
-    duration_counts: dict[str, int] = {}
+    time_edges = [start]
     stop = start + td
-    count = 0
-    key = fmt_time(start)
-    for time in meme_times:
-        while time >= stop:
-            duration_counts[key] = count
-            key = fmt_time(stop)
-            stop += td
-            count = 0
-        count += 1
-    duration_counts[key] = count
     while stop <= now:
-        key = fmt_time(stop)
+        time_edges.append(stop)
         stop += td
-        duration_counts[key] = 0
+    counts = await get_meme_generation_duration_counts(
+        session, id_type, time_edges, meme_keys=meme_keys, precision=precision
+    )
+    duration_counts: dict[str, int] = {}
+    for time, count in zip(time_edges, counts):
+        duration_counts[fmt_time(time)] = count
 
-    key_counts: dict[str, int] = {}
-    for key in meme_keys:
-        key_counts[key] = key_counts.get(key, 0) + 1
     key_counts = dict(sorted(key_counts.items(), key=lambda item: item[1]))
 
     if meme:
@@ -220,14 +226,19 @@ async def _(
             f"表情“{'/'.join(meme.keywords)}”{humanized}调用统计"
             f"（总调用次数为 {key_counts.get(meme.key, 0)}）"
         )
-        output = await plot_duration_counts(duration_counts, title)
+        plot = plot_duration_counts(duration_counts, title)
     else:
         title = f"{humanized}表情调用统计（总调用次数为 {sum(key_counts.values())}）"
         meme_counts: dict[str, int] = {}
         for key, count in key_counts.items():
             if meme := meme_manager.get_meme(key):
                 meme_counts["/".join(meme.keywords)] = count
-        output = await plot_meme_and_duration_counts(
-            meme_counts, duration_counts, title
-        )
+        plot = plot_meme_and_duration_counts(meme_counts, duration_counts, title)
+
+    try:
+        output = await plot
+    except RenderQueueFull:
+        await matcher.finish("当前统计图绘制任务过多，请稍后再试")
+    if statistics_cache.max_bytes and statistics_cache.ttl:
+        statistics_cache.set(cache_key, output.getvalue())
     await UniMessage.image(raw=output).send()
@@ -0,0 +1,124 @@
+from collections.abc import Iterable
+
+from nonebot_plugin_orm import Model, get_session
+from sqlalchemy import Index, String, UniqueConstraint, delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+class MemePermissionMode(Model):
+    """表情管控模式"""
+
+    __tablename__ = "nonebot_plugin_memes_memepermissionmode"
+    __table_args__ = ({"extend_existing": True},)
+
+    meme_key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    """ 表情名 """
+    mode: Mapped[int]
+    """ 管控模式，0 为黑名单模式，1 为白名单模式 """
+
+
+class MemePermissionEntry(Model):
+    """表情黑/白名单中的用户"""
+
+    __tablename__ = "nonebot_plugin_memes_memepermissionentry"
+    __table_args__ = (
+        UniqueConstraint(
+            "meme_key", "list_type", "user_id", name="uq_memes_permission_entry"
+        ),
+        Index("ix_memes_permission_entry_user_id", "user_id"),
+        {"extend_existing": True},
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    meme_key: Mapped[str] = mapped_column(String(64))
+    """ 表情名 """
+    list_type: Mapped[int]
+    """ 名单类型，0 为黑名单，1 为白名单 """
+    user_id: Mapped[str] = mapped_column(String(255))
+    """ 用户id """
+
+
+PermissionRows = tuple[dict[str, int], list[tuple[str, int, str]]]
+""" 各表情的管控模式，以及 (表情名, 名单类型, 用户id) 列表 """
+
+
+async def load_permissions() -> PermissionRows:
+    async with get_session() as db_session:
+        modes = await db_session.execute(
+            select(MemePermissionMode.meme_key, MemePermissionMode.mode)
+        )
+        entries = await db_session.execute(
+            select(
+                MemePermissionEntry.meme_key,
+                MemePermissionEntry.list_type,
+                MemePermissionEntry.user_id,
+            ).order_by(MemePermissionEntry.id)
+        )
+        return (
+            dict(modes.tuples().all()),
+            list(entries.tuples().all()),
+        )
+
+
+async def is_permissions_empty() -> bool:
+    async with get_session() as db_session:
+        count = await db_session.scalar(select(func.count(MemePermissionMode.meme_key)))
+        return not count
+
+
+async def import_permissions(
+    modes: dict[str, int], entries: Iterable[tuple[str, int, str]]
+):
+    """批量写入管控模式和名单，用于从配置文件导入"""
+    async with get_session() as db_session:
+        if modes:
+            await db_session.execute(
+                insert(MemePermissionMode),
+                [
+                    {"meme_key": meme_key, "mode": mode}
+                    for meme_key, mode in modes.items()
+                ],
+            )
+        if entries := list(dict.fromkeys(entries)):
+            await db_session.execute(
+                insert(MemePermissionEntry),
+                [
+                    {"meme_key": meme_key, "list_type": list_type, "user_id": user_id}
+                    for meme_key, list_type, user_id in entries
+                ],
+            )
+        await db_session.commit()
+
+
+async def save_mode(meme_key: str, mode: int):
+    async with get_session() as db_session:
+        if row := await db_session.get(MemePermissionMode, meme_key):
+            row.mode = mode
+        else:
+            db_session.add(MemePermissionMode(meme_key=meme_key, mode=mode))
+        await db_session.commit()
+
+
+async def add_entry(meme_key: str, list_type: int, user_id: str):
+    async with get_session() as db_session:
+        db_session.add(
+            MemePermissionEntry(meme_key=meme_key, list_type=list_type, user_id=user_id)
+        )
+        try:
+            await db_session.commit()
+        except IntegrityError:
+            # 已存在相同的记录
+            await db_session.rollback()
+
+
+async def remove_entry(meme_key: str, list_type: int, user_id: str):
+    async with get_session() as db_session:
+        await db_session.execute(
+            delete(MemePermissionEntry).where(
+                MemePermissionEntry.meme_key == meme_key,
+                MemePermissionEntry.list_type == list_type,
+                MemePermissionEntry.user_id == user_id,
+            )
+        )
+        await db_session.commit()
@@ -1,79 +1,67 @@
+import asyncio
 from io import BytesIO
 
-import matplotlib
-from matplotlib import pyplot as plt
-from matplotlib.axes import Axes
-from matplotlib.font_manager import fontManager
-from matplotlib.ticker import MaxNLocator
+from nonebot import get_driver
+from nonebot.log import logger
 from nonebot.utils import run_sync
 
-matplotlib.use("agg")
-plt.style.use("bmh")
-fallback_fonts = [
-    "PingFang SC",
-    "Hiragino Sans GB",
-    "Microsoft YaHei",
-    "Source Han Sans SC",
-    "Noto Sans SC",
-    "Noto Sans CJK SC",
-    "WenQuanYi Micro Hei",
-]
-for fontfamily in fallback_fonts.copy():
-    try:
-        fontManager.findfont(fontfamily, fallback_to_default=False)
-    except ValueError:
-        fallback_fonts.remove(fontfamily)
-matplotlib.rcParams["font.family"] = fallback_fonts
+from . import worker
+from .cache import plot_font_cache_file
+from .config import memes_config
+from .render import max_workers, run_in_executor, use_process_pool
 
 
-@run_sync
-def plot_meme_and_duration_counts(
+async def plot_meme_and_duration_counts(
     meme_counts: dict[str, int], duration_counts: dict[str, int], title: str
 ) -> BytesIO:
-    up_x = list(meme_counts.keys())
-    up_y = list(meme_counts.values())
-    low_x = list(duration_counts.keys())
-    low_y = list(duration_counts.values())
-    num = len(up_x)
-    up_height = num * 0.3
-    low_height = 3
-    fig_width = 8
-    fig, axs = plt.subplots(
-        nrows=2,
-        figsize=(fig_width, up_height + low_height),
-        height_ratios=[up_height, low_height],
-        constrained_layout=True,
+    return BytesIO(
+        await run_in_executor(
+            worker.plot_meme_and_duration_counts,
+            meme_counts,
+            duration_counts,
+            title,
+            plot_font_cache_file,
+        )
+    )
+
+
+async def plot_duration_counts(duration_counts: dict[str, int], title: str) -> BytesIO:
+    return BytesIO(
+        await run_in_executor(
+            worker.plot_duration_counts, duration_counts, title, plot_font_cache_file
+        )
     )
-    up: Axes = axs[0]
-    up.barh(range(num), up_y, height=0.5)
-    up.set_ylim(-1, num)
-    up.set_yticks(range(num), up_x)
-    up.xaxis.set_major_locator(MaxNLocator(integer=True))
-    low: Axes = axs[1]
-    low.plot(low_x, low_y, marker="o")
-    if len(low_x) > 24:
-        low.set_xticks(low_x[::3])
-    elif len(low_x) > 12:
-        low.set_xticks(low_x[::2])
-    low.yaxis.set_major_locator(MaxNLocator(integer=True))
-    fig.suptitle(title)
-    output = BytesIO()
-    fig.savefig(output, bbox_inches="tight", pad_inches=0.2)
-    return output
 
 
-@run_sync
-def plot_duration_counts(duration_counts: dict[str, int], title: str) -> BytesIO:
-    x = list(duration_counts.keys())
-    y = list(duration_counts.values())
-    fig, ax = plt.subplots(figsize=(6, 4), constrained_layout=True)
-    ax.plot(x, y, marker="o")
-    if len(x) > 24:
-        ax.set_xticks(x[::3])
-    elif len(x) > 12:
-        ax.set_xticks(x[::2])
-    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
-    fig.suptitle(title)
-    output = BytesIO()
-    fig.savefig(output, bbox_inches="tight", pad_inches=0.2)
-    return output
+async def warmup():
+    """在后台加载 matplotlib
+
+    使用进程池时渲染进程启动时即会加载（见 `worker.init_worker`），
+    这里提前启动各个渲染进程
+    """
+    try:
+        if use_process_pool():
+            await asyncio.gather(
+                *(
+                    run_in_executor(worker.init_matplotlib, plot_font_cache_file)
+                    for _ in range(max_workers())
+                )
+            )
+        else:
+            await run_sync(worker.init_matplotlib)(plot_font_cache_file)
+    except Exception:
+        logger.exception("matplotlib 加载失败")
+
+
+_background_tasks: set[asyncio.Task] = set()
+""" 后台加载 matplotlib 的任务，保留引用以免任务被回收 """
+
+
+if memes_config.memes_plot_warmup:
+    driver = get_driver()
+
+    @driver.on_startup
+    async def _():
+        task = asyncio.create_task(warmup())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
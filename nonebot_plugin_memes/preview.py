@@ -0,0 +1,105 @@
+import asyncio
+from typing import Optional
+
+from meme_generator import Meme
+from nonebot import get_driver
+from nonebot.log import logger
+from nonebot.utils import run_sync
+
+from .cache import MB, LRUCache, memes_cache_dir
+from .config import memes_config
+from .manager import meme_manager, meme_mtime
+from .render import render_preview
+
+preview_dir = memes_cache_dir / "previews"
+preview_cache = LRUCache[str, tuple[str, bytes]](
+    max_bytes=memes_config.memes_preview_cache_memory_size * MB,
+    sizeof=lambda item: len(item[1]),
+)
+_background_tasks: set[asyncio.Task] = set()
+""" 后台预生成预览图的任务，保留引用以免任务被回收 """
+
+
+def preview_version(meme: Meme) -> str:
+    version = meme.date_modified.strftime("%Y%m%d%H%M%S%f")
+    if mtime := meme_mtime(meme.key):
+        version += f"-{mtime:.6f}"
+    return version
+
+
+def read_preview(meme_key: str, version: str) -> Optional[bytes]:
+    file = preview_dir / meme_key / version
+    try:
+        return file.read_bytes()
+    except OSError:
+        return None
+
+
+def write_preview(meme_key: str, version: str, data: bytes):
+    meme_dir = preview_dir / meme_key
+    try:
+        meme_dir.mkdir(parents=True, exist_ok=True)
+        # 表情修改后旧的预览图不再使用
+        for file in meme_dir.iterdir():
+            if file.name != version:
+                file.unlink(missing_ok=True)
+        (meme_dir / version).write_bytes(data)
+    except OSError as e:
+        logger.warning(f"表情 {meme_key} 预览图缓存失败：{e}")
+
+
+def remove_preview_files(meme_key: str):
+    meme_dir = preview_dir / meme_key
+    if meme_dir.exists():
+        for file in meme_dir.iterdir():
+            file.unlink(missing_ok=True)
+
+
+async def remove_preview(meme_key: str):
+    # 内存缓存只在事件循环中访问，只有删除文件在线程中进行
+    preview_cache.pop(meme_key)
+    await run_sync(remove_preview_files)(meme_key)
+
+
+async def get_meme_preview(meme: Meme) -> bytes:
+    """获取表情预览图，按表情修改时间缓存"""
+    version = preview_version(meme)
+    if (cached := preview_cache.get(meme.key)) and cached[0] == version:
+        return cached[1]
+
+    data = None
+    if memes_config.memes_preview_cache_disk:
+        data = await run_sync(read_preview)(meme.key, version)
+    if data is None:
+        data = (await render_preview(meme)).getvalue()
+        if memes_config.memes_preview_cache_disk:
+            await run_sync(write_preview)(meme.key, version, data)
+    if preview_cache.max_bytes:
+        preview_cache.set(meme.key, (version, data))
+    return data
+
+
+async def pregenerate_previews():
+    memes = meme_manager.get_memes()
+    logger.info(f"正在预生成 {len(memes)} 个表情的预览图...")
+    for meme in memes:
+        try:
+            await get_meme_preview(meme)
+        except Exception as e:
+            logger.warning(f"表情 {meme.key} 预览图生成失败：{e}")
+    logger.info("表情预览图预生成完成")
+
+
+if memes_config.memes_preview_pregenerate:
+    driver = get_driver()
+
+    @driver.on_startup
+    async def _():
+        task = asyncio.create_task(pregenerate_previews())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    @driver.on_shutdown
+    async def _():
+        for task in _background_tasks:
+            task.cancel()
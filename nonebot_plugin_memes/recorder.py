@@ -1,10 +1,15 @@
+import asyncio
+from collections import Counter
+from collections.abc import AsyncIterator, Collection
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
+from nonebot import get_driver
+from nonebot.log import logger
 from nonebot_plugin_orm import Model, get_session
-from nonebot_plugin_uninfo import Session, SupportScope
+from nonebot_plugin_uninfo import SceneType, Session, SupportScope
 from nonebot_plugin_uninfo.orm import (
     BotModel,
     SceneModel,
@@ -12,17 +17,37 @@ from nonebot_plugin_uninfo.orm import (
     UserModel,
     get_session_persist_id,
 )
-from sqlalchemy import ColumnElement, String, select
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import (
+    ColumnElement,
+    Index,
+    Select,
+    String,
+    UniqueConstraint,
+    case,
+    delete,
+    func,
+    insert,
+    literal_column,
+    select,
+    union_all,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute, Mapped, mapped_column
 
-from .utils import remove_timezone
+from .config import memes_config
+from .utils import count_by_edges, remove_timezone
 
 
 class MemeGenerationRecord(Model):
     """表情调用记录"""
 
     __tablename__ = "nonebot_plugin_memes_memegenerationrecord_v2"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_memes_record_v2_time", "time"),
+        Index("ix_memes_record_v2_meme_key_time", "meme_key", "time"),
+        Index("ix_memes_record_v2_session_time", "session_persist_id", "time"),
+        {"extend_existing": True},
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     session_persist_id: Mapped[int]
@@ -33,25 +58,288 @@ class MemeGenerationRecord(Model):
     """ 表情名 """
 
 
+class MemeGenerationCount:
+    id: Mapped[int] = mapped_column(primary_key=True)
+    session_persist_id: Mapped[int]
+    """ 会话持久化id """
+    time: Mapped[datetime]
+    """ 时段开始时间\n\n存放 UTC 时间 """
+    meme_key: Mapped[str] = mapped_column(String(64))
+    """ 表情名 """
+    count: Mapped[int]
+    """ 时段内的调用次数 """
+
+
+class MemeGenerationHourlyCount(MemeGenerationCount, Model):
+    """表情调用次数（按小时汇总）"""
+
+    __tablename__ = "nonebot_plugin_memes_memegenerationhourlycount"
+    __table_args__ = (
+        UniqueConstraint(
+            "session_persist_id", "meme_key", "time", name="uq_memes_hourly_count"
+        ),
+        Index("ix_memes_hourly_count_time", "time"),
+        {"extend_existing": True},
+    )
+
+
+class MemeGenerationDailyCount(MemeGenerationCount, Model):
+    """表情调用次数（按天汇总）"""
+
+    __tablename__ = "nonebot_plugin_memes_memegenerationdailycount"
+    __table_args__ = (
+        UniqueConstraint(
+            "session_persist_id", "meme_key", "time", name="uq_memes_daily_count"
+        ),
+        Index("ix_memes_daily_count_time", "time"),
+        {"extend_existing": True},
+    )
+
+
+ROLLUP_MODELS: list[tuple[type[MemeGenerationCount], timedelta]] = [
+    (MemeGenerationDailyCount, timedelta(days=1)),
+    (MemeGenerationHourlyCount, timedelta(hours=1)),
+]
+""" 汇总表及其时间粒度，按粒度从大到小排列 """
+
+T_RecordModel = Union[type[MemeGenerationRecord], type[MemeGenerationCount]]
+
+
 @dataclass
 class MemeRecord:
     time: datetime
     meme_key: str
+    count: int = 1
 
 
-async def record_meme_generation(session: Session, meme_key: str):
-    session_persist_id = await get_session_persist_id(session)
+@dataclass
+class MemeRecordDetail:
+    """带有会话信息的表情调用记录，用于导出"""
 
-    record = MemeGenerationRecord(
-        session_persist_id=session_persist_id,
-        time=remove_timezone(datetime.now(timezone.utc)),
-        meme_key=meme_key,
+    id: int
+    time: datetime
+    meme_key: str
+    scope: str
+    self_id: str
+    scene_type: int
+    scene_id: str
+    user_id: str
+
+
+@dataclass
+class PendingRecord:
+    session: Session
+    time: datetime
+    meme_key: str
+
+
+_pending_records: list[PendingRecord] = []
+_record_versions: Counter[tuple[str, ...]] = Counter()
+""" 各统计范围内新增调用记录的次数，用于判断统计结果是否变化 """
+_flush_lock: Optional[asyncio.Lock] = None
+_flush_task: Optional[asyncio.Task] = None
+_compact_task: Optional[asyncio.Task] = None
+_background_flushes: set[asyncio.Task] = set()
+""" 缓冲区写满时启动的写入任务，保留引用以免任务被回收 """
+
+COMPACT_INTERVAL = 3600
+""" 删除过期记录的时间间隔，单位：秒 """
+COMPACT_BATCH_INTERVAL = 0.1
+""" 分批删除过期记录时每批之间的间隔，单位：秒 """
+
+
+def session_key(session: Session) -> tuple[str, ...]:
+    return (
+        scope_value(session.scope),
+        session.self_id,
+        str(session.scene.type.value),
+        session.scene.id,
+        session.user.id,
     )
+
+
+async def write_records(records: list[PendingRecord]):
+    persist_ids: dict[tuple[str, ...], int] = {}
+    for record in records:
+        key = session_key(record.session)
+        if key not in persist_ids:
+            persist_ids[key] = await get_session_persist_id(record.session)
+
+    rows = [
+        {
+            "session_persist_id": persist_ids[session_key(record.session)],
+            "time": record.time,
+            "meme_key": record.meme_key,
+        }
+        for record in records
+    ]
     async with get_session() as db_session:
-        db_session.add(record)
+        await db_session.execute(insert(MemeGenerationRecord), rows)
+        for model, granularity in ROLLUP_MODELS:
+            await update_counts(
+                db_session,
+                model,
+                Counter(
+                    (
+                        row["session_persist_id"],
+                        row["meme_key"],
+                        truncate_time(row["time"], granularity),
+                    )
+                    for row in rows
+                ),
+            )
         await db_session.commit()
 
 
+def truncate_time(time: datetime, granularity: timedelta) -> datetime:
+    """将 UTC 时间向下取整到 `granularity` 的整数倍"""
+    time = remove_timezone(time)
+    return time - (time - datetime.min) % granularity
+
+
+def is_aligned(time: Optional[datetime], granularity: timedelta) -> bool:
+    return time is None or truncate_time(time, granularity) == remove_timezone(time)
+
+
+async def update_counts(
+    db_session: AsyncSession,
+    model: type[MemeGenerationCount],
+    counts: Counter[tuple[int, str, datetime]],
+):
+    """将新增的调用次数累加到汇总表中"""
+    statement = select(model).where(
+        model.session_persist_id.in_({key[0] for key in counts}),
+        model.meme_key.in_({key[1] for key in counts}),
+        model.time.in_({key[2] for key in counts}),
+    )
+    for row in (await db_session.scalars(statement)).all():
+        if count := counts.pop((row.session_persist_id, row.meme_key, row.time), 0):
+            row.count += count
+    db_session.add_all(
+        model(
+            session_persist_id=session_persist_id,
+            meme_key=meme_key,
+            time=time,
+            count=count,
+        )
+        for (session_persist_id, meme_key, time), count in counts.items()
+    )
+
+
+async def flush_records():
+    """将缓冲区中的调用记录批量写入数据库"""
+    global _flush_lock
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+
+    async with _flush_lock:
+        if not _pending_records:
+            return
+        records = _pending_records.copy()
+        _pending_records.clear()
+        try:
+            await write_records(records)
+        except Exception:
+            logger.exception(f"表情调用记录写入失败，{len(records)} 条记录将稍后重试")
+            _pending_records[:0] = records
+
+
+async def record_meme_generation(session: Session, meme_key: str):
+    record = PendingRecord(
+        session=session,
+        time=remove_timezone(datetime.now(timezone.utc)),
+        meme_key=meme_key,
+    )
+    _pending_records.append(record)
+    for id_type in SessionIdType:
+        _record_versions[session_scope_key(session, id_type)] += 1
+    if memes_config.memes_record_flush_interval <= 0:
+        await flush_records()
+    elif len(_pending_records) >= memes_config.memes_record_batch_size:
+        task = asyncio.create_task(flush_records())
+        _background_flushes.add(task)
+        task.add_done_callback(_background_flushes.discard)
+
+
+async def flush_records_periodically():
+    while True:
+        await asyncio.sleep(memes_config.memes_record_flush_interval)
+        await flush_records()
+
+
+def retention_boundary() -> Optional[datetime]:
+    """逐条记录和按小时汇总的调用次数的保留起始时间，早于该时间的只保留按天汇总的调用次数"""
+    retention_days = memes_config.memes_record_retention_days
+    if retention_days <= 0:
+        return None
+    return truncate_time(
+        datetime.now(timezone.utc) - timedelta(days=retention_days), timedelta(days=1)
+    )
+
+
+async def compact_records():
+    """删除超过保留天数的逐条记录和按小时汇总的调用次数
+
+    写入记录时已同步累加到按天汇总的表中，因此这里只需分批删除，
+    每批单独提交，避免长时间占用数据库
+    """
+    if not (boundary := retention_boundary()):
+        return
+    batch_size = max(memes_config.memes_record_compact_batch_size, 1)
+    for model in (MemeGenerationRecord, MemeGenerationHourlyCount):
+        deleted = 0
+        while True:
+            async with get_session() as db_session:
+                ids = (
+                    await db_session.scalars(
+                        select(model.id)
+                        .where(model.time < boundary)
+                        .order_by(model.id)
+                        .limit(batch_size)
+                    )
+                ).all()
+                if not ids:
+                    break
+                await db_session.execute(delete(model).where(model.id.in_(ids)))
+                await db_session.commit()
+            deleted += len(ids)
+            await asyncio.sleep(COMPACT_BATCH_INTERVAL)
+        if deleted:
+            logger.info(
+                f"已删除 {deleted} 条过期的表情调用记录（{model.__tablename__}）"
+            )
+
+
+async def compact_records_periodically():
+    while True:
+        try:
+            await compact_records()
+        except Exception:
+            logger.exception("删除过期的表情调用记录失败")
+        await asyncio.sleep(COMPACT_INTERVAL)
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _():
+    global _flush_task, _compact_task
+    if memes_config.memes_record_flush_interval > 0:
+        _flush_task = asyncio.create_task(flush_records_periodically())
+    if memes_config.memes_record_retention_days > 0:
+        _compact_task = asyncio.create_task(compact_records_periodically())
+
+
+@driver.on_shutdown
+async def _():
+    if _flush_task:
+        _flush_task.cancel()
+    if _compact_task:
+        _compact_task.cancel()
+    await flush_records()
+
+
 class SessionIdType(Enum):
     GLOBAL = 0
     USER = 1
@@ -63,13 +351,30 @@ def scope_value(scope: Union[str, SupportScope]) -> str:
     return scope.value if isinstance(scope, SupportScope) else scope
 
 
+def session_scope_key(session: Session, id_type: SessionIdType) -> tuple[str, ...]:
+    """统计范围的标识"""
+    key = (str(id_type.value), scope_value(session.scope), session.self_id)
+    if id_type in (SessionIdType.GROUP, SessionIdType.GROUP_USER):
+        key += (str(session.scene.type.value), session.scene.id)
+    if id_type in (SessionIdType.USER, SessionIdType.GROUP_USER):
+        key += (session.user.id,)
+    return key
+
+
+def record_version(session: Session, id_type: SessionIdType) -> int:
+    """统计范围内的记录版本，本次运行中该范围内有新的调用记录时增加"""
+    return _record_versions[session_scope_key(session, id_type)]
+
+
 def filter_statement(
     session: Session,
     id_type: SessionIdType,
     *,
     meme_key: Optional[str] = None,
+    meme_keys: Optional[Collection[str]] = None,
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
+    model: T_RecordModel = MemeGenerationRecord,
 ) -> list[ColumnElement[bool]]:
     filter_scene = True
     filter_user = True
@@ -92,14 +397,83 @@ def filter_statement(
         whereclause.append(UserModel.user_id == session.user.id)
 
     if meme_key:
-        whereclause.append(MemeGenerationRecord.meme_key == meme_key)
+        whereclause.append(model.meme_key == meme_key)
+    if meme_keys is not None:
+        whereclause.append(model.meme_key.in_(meme_keys))
     if time_start:
-        whereclause.append(MemeGenerationRecord.time >= remove_timezone(time_start))
+        whereclause.append(model.time >= remove_timezone(time_start))
     if time_stop:
-        whereclause.append(MemeGenerationRecord.time <= remove_timezone(time_stop))
+        if model is MemeGenerationRecord:
+            whereclause.append(model.time <= remove_timezone(time_stop))
+        else:
+            # 汇总表中的时间为时段开始时间
+            whereclause.append(model.time < remove_timezone(time_stop))
     return whereclause
 
 
+def join_session_models(statement: Select, model: T_RecordModel) -> Select:
+    return (
+        statement.join(SessionModel, SessionModel.id == model.session_persist_id)
+        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
+        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
+        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    )
+
+
+def count_column(model: T_RecordModel) -> ColumnElement[int]:
+    if model is MemeGenerationRecord:
+        return func.count(model.id)
+    return func.sum(model.count)
+
+
+def rollup_model(
+    precision: Optional[timedelta], *times: Optional[datetime]
+) -> Optional[type[MemeGenerationCount]]:
+    """查询的时间边界与汇总表粒度对齐、且调用方所需精度不高于该粒度时，返回对应的汇总表"""
+    if not precision:
+        return None
+    for model, granularity in ROLLUP_MODELS:
+        if precision >= granularity and all(
+            is_aligned(time, granularity) for time in times
+        ):
+            return model
+    return None
+
+
+QuerySegment = tuple[T_RecordModel, Optional[datetime], Optional[datetime]]
+
+
+def query_segments(
+    precision: Optional[timedelta],
+    time_start: Optional[datetime],
+    time_stop: Optional[datetime],
+    *times: Optional[datetime],
+) -> list[QuerySegment]:
+    """根据所需精度和保留天数，将查询时段拆分为 `(表, 开始时间, 结束时间)`
+
+    早于保留起始时间的部分只能从按天汇总的表中查询
+    """
+    model = (
+        rollup_model(precision, time_start, time_stop, *times) or MemeGenerationRecord
+    )
+    boundary = retention_boundary()
+    if (
+        model is MemeGenerationDailyCount
+        or boundary is None
+        or (time_start and remove_timezone(time_start) >= boundary)
+    ):
+        return [(model, time_start, time_stop)]
+
+    # 按天汇总的表中时间为当天开始时间，开始时间所在的那一天也计入
+    daily_start = truncate_time(time_start, timedelta(days=1)) if time_start else None
+    if time_stop and remove_timezone(time_stop) <= boundary:
+        return [(MemeGenerationDailyCount, daily_start, time_stop)]
+    return [
+        (MemeGenerationDailyCount, daily_start, boundary),
+        (model, boundary, time_stop),
+    ]
+
+
 async def get_meme_generation_records(
     session: Session,
     id_type: SessionIdType,
@@ -107,21 +481,41 @@ async def get_meme_generation_records(
     meme_key: Optional[str] = None,
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
+    precision: Optional[timedelta] = None,
 ) -> list[MemeRecord]:
-    whereclause = filter_statement(
-        session, id_type, meme_key=meme_key, time_start=time_start, time_stop=time_stop
-    )
-    statement = (
-        select(MemeGenerationRecord.time, MemeGenerationRecord.meme_key)
-        .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
-        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
-        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
-        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
-    )
-    async with get_session() as db_session:
-        results = (await db_session.execute(statement)).all()
-    return [MemeRecord(result[0], result[1]) for result in results]
+    """获取表情调用记录
+
+    `precision` 为调用方所需的时间精度，设置后会尽量从汇总表中查询，
+    此时返回的 `time` 为时段开始时间，`count` 为时段内的调用次数；
+    早于保留起始时间的记录总是按天汇总
+    """
+    await flush_records()
+    records: list[MemeRecord] = []
+    for model, start, stop in query_segments(precision, time_start, time_stop):
+        whereclause = filter_statement(
+            session,
+            id_type,
+            meme_key=meme_key,
+            time_start=start,
+            time_stop=stop,
+            model=model,
+        )
+        if model is MemeGenerationRecord:
+            statement = join_session_models(
+                select(model.time, model.meme_key), model
+            ).where(*whereclause)
+        else:
+            statement = (
+                join_session_models(
+                    select(model.time, model.meme_key, func.sum(model.count)), model
+                )
+                .where(*whereclause)
+                .group_by(model.time, model.meme_key)
+            )
+        async with get_session() as db_session:
+            results = (await db_session.execute(statement)).all()
+        records.extend(MemeRecord(*result) for result in results)
+    return records
 
 
 async def get_meme_generation_times(
@@ -131,18 +525,27 @@ async def get_meme_generation_times(
     meme_key: Optional[str] = None,
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
+    precision: Optional[timedelta] = None,
 ) -> list[datetime]:
+    segments = query_segments(precision, time_start, time_stop)
+    if len(segments) > 1 or segments[0][0] is not MemeGenerationRecord:
+        records = await get_meme_generation_records(
+            session,
+            id_type,
+            meme_key=meme_key,
+            time_start=time_start,
+            time_stop=time_stop,
+            precision=precision,
+        )
+        return [record.time for record in records for _ in range(record.count)]
+
+    await flush_records()
     whereclause = filter_statement(
         session, id_type, meme_key=meme_key, time_start=time_start, time_stop=time_stop
     )
-    statement = (
-        select(MemeGenerationRecord.time)
-        .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
-        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
-        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
-        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
-    )
+    statement = join_session_models(
+        select(MemeGenerationRecord.time), MemeGenerationRecord
+    ).where(*whereclause)
     async with get_session() as db_session:
         results = (await db_session.scalars(statement)).all()
     return list(results)
@@ -155,17 +558,289 @@ async def get_meme_generation_keys(
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
 ) -> list[str]:
+    if len(query_segments(None, time_start, time_stop)) > 1:
+        records = await get_meme_generation_records(
+            session, id_type, time_start=time_start, time_stop=time_stop
+        )
+        return [record.meme_key for record in records for _ in range(record.count)]
+
+    await flush_records()
     whereclause = filter_statement(
         session, id_type, time_start=time_start, time_stop=time_stop
     )
-    statement = (
-        select(MemeGenerationRecord.meme_key)
-        .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MemeGenerationRecord.session_persist_id)
-        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
-        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
-        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
-    )
+    statement = join_session_models(
+        select(MemeGenerationRecord.meme_key), MemeGenerationRecord
+    ).where(*whereclause)
     async with get_session() as db_session:
         results = (await db_session.scalars(statement)).all()
     return list(results)
+
+
+async def get_meme_generation_key_counts(
+    session: Session,
+    id_type: SessionIdType,
+    *,
+    meme_keys: Optional[Collection[str]] = None,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+    precision: Optional[timedelta] = None,
+) -> dict[str, int]:
+    """按表情统计调用次数，按首次调用时间排序"""
+    await flush_records()
+    key_counts: Counter[str] = Counter()
+    first_times: dict[str, datetime] = {}
+    for model, start, stop in query_segments(precision, time_start, time_stop):
+        whereclause = filter_statement(
+            session,
+            id_type,
+            meme_keys=meme_keys,
+            time_start=start,
+            time_stop=stop,
+            model=model,
+        )
+        statement = (
+            join_session_models(
+                select(model.meme_key, count_column(model), func.min(model.time)),
+                model,
+            )
+            .where(*whereclause)
+            .group_by(model.meme_key)
+        )
+        async with get_session() as db_session:
+            results = (await db_session.execute(statement)).all()
+        for meme_key, count, first_time in results:
+            key_counts[meme_key] += int(count)
+            if meme_key not in first_times or first_time < first_times[meme_key]:
+                first_times[meme_key] = first_time
+    return {
+        key: key_counts[key] for key in sorted(key_counts, key=first_times.__getitem__)
+    }
+
+
+async def get_meme_generation_duration_counts(
+    session: Session,
+    id_type: SessionIdType,
+    time_edges: list[datetime],
+    *,
+    meme_keys: Optional[Collection[str]] = None,
+    precision: Optional[timedelta] = None,
+) -> list[int]:
+    """统计各时段内的调用次数
+
+    第 i 个时段为 `[time_edges[i], time_edges[i + 1])`，最后一个时段不设上限
+    """
+    await flush_records()
+    counts = [0] * len(time_edges)
+    for model, start, stop in query_segments(
+        precision, time_edges[0], None, *time_edges
+    ):
+        whereclause = filter_statement(
+            session,
+            id_type,
+            meme_keys=meme_keys,
+            time_start=start,
+            time_stop=stop,
+            model=model,
+        )
+        if model is not MemeGenerationRecord:
+            # 汇总表中的记录已按时段合并，取出后在本地分段统计
+            statement = (
+                join_session_models(select(model.time, count_column(model)), model)
+                .where(*whereclause)
+                .group_by(model.time)
+            )
+            async with get_session() as db_session:
+                results = (await db_session.execute(statement)).all()
+            segment_counts = count_by_edges(
+                [result[0] for result in results],
+                time_edges,
+                [result[1] for result in results],
+            )
+            counts = [a + b for a, b in zip(counts, segment_counts)]
+            continue
+
+        if len(time_edges) == 1:
+            statement = join_session_models(select(count_column(model)), model).where(
+                *whereclause
+            )
+            async with get_session() as db_session:
+                counts[0] += int((await db_session.scalar(statement)) or 0)
+            continue
+
+        # 逐条记录数量较多，直接在数据库中分段统计，避免取出所有记录
+        bucket = case(
+            *(
+                (model.time < remove_timezone(edge), index)
+                for index, edge in enumerate(time_edges[1:])
+            ),
+            else_=len(time_edges) - 1,
+        ).label("bucket")
+        statement = (
+            join_session_models(select(bucket, count_column(model)), model)
+            .where(*whereclause)
+            # 按输出列名分组，避免在分组语句中重复绑定参数
+            .group_by(literal_column("bucket"))
+        )
+        async with get_session() as db_session:
+            results = (await db_session.execute(statement)).all()
+        for index, count in results:
+            counts[index] += int(count)
+    return counts
+
+
+async def get_meme_generation_top_counts(
+    session: Session,
+    id_type: SessionIdType,
+    group_columns: list[InstrumentedAttribute],
+    *,
+    meme_keys: Optional[Collection[str]] = None,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+    precision: Optional[timedelta] = None,
+    extra_whereclause: Collection[ColumnElement[bool]] = (),
+    limit: int = 10,
+) -> list[tuple[Any, ...]]:
+    """按 `group_columns` 分组统计调用次数，返回次数最多的 `limit` 组
+
+    每行为分组列的值加上调用次数；分组、排序和截取均在数据库中完成
+    """
+    await flush_records()
+    statements = []
+    for model, start, stop in query_segments(precision, time_start, time_stop):
+        whereclause = filter_statement(
+            session,
+            id_type,
+            meme_keys=meme_keys,
+            time_start=start,
+            time_stop=stop,
+            model=model,
+        )
+        statements.append(
+            join_session_models(
+                select(*group_columns, count_column(model).label("count")), model
+            )
+            .where(*whereclause, *extra_whereclause)
+            .group_by(*group_columns)
+        )
+    # 跨越保留起始时间时，分别统计后再合并
+    if len(statements) > 1:
+        subquery = union_all(*statements).subquery()
+    else:
+        subquery = statements[0].subquery()
+    columns = [subquery.c[column.key] for column in group_columns]
+    total = func.sum(subquery.c["count"])
+    statement = (
+        select(*columns, total)
+        .group_by(*columns)
+        .order_by(total.desc(), *columns)
+        .limit(limit)
+    )
+    async with get_session() as db_session:
+        results = (await db_session.execute(statement)).all()
+    return [(*result[:-1], int(result[-1])) for result in results]
+
+
+async def get_meme_generation_top_users(
+    session: Session,
+    id_type: SessionIdType,
+    *,
+    meme_keys: Optional[Collection[str]] = None,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+    precision: Optional[timedelta] = None,
+    limit: int = 10,
+) -> list[tuple[str, int]]:
+    """调用次数最多的用户，返回 `(用户id, 调用次数)`"""
+    results = await get_meme_generation_top_counts(
+        session,
+        id_type,
+        [UserModel.user_id],
+        meme_keys=meme_keys,
+        time_start=time_start,
+        time_stop=time_stop,
+        precision=precision,
+        limit=limit,
+    )
+    return [(user_id, count) for user_id, count in results]
+
+
+async def get_meme_generation_top_scenes(
+    session: Session,
+    id_type: SessionIdType,
+    *,
+    meme_keys: Optional[Collection[str]] = None,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+    precision: Optional[timedelta] = None,
+    limit: int = 10,
+) -> list[tuple[SceneType, str, int]]:
+    """调用次数最多的群聊/频道（不包括私聊），返回 `(场景类型, 场景id, 调用次数)`"""
+    results = await get_meme_generation_top_counts(
+        session,
+        id_type,
+        [SceneModel.scene_type, SceneModel.scene_id],
+        meme_keys=meme_keys,
+        time_start=time_start,
+        time_stop=time_stop,
+        precision=precision,
+        extra_whereclause=[SceneModel.scene_type != SceneType.PRIVATE.value],
+        limit=limit,
+    )
+    return [
+        (SceneType(scene_type), scene_id, count)
+        for scene_type, scene_id, count in results
+    ]
+
+
+async def iter_meme_generation_records(
+    *,
+    meme_key: Optional[str] = None,
+    time_start: Optional[datetime] = None,
+    time_stop: Optional[datetime] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[list[MemeRecordDetail]]:
+    """按 id 分批获取逐条的表情调用记录
+
+    使用 id 作为游标分页，每批单独查询，不会长时间占用数据库；
+    只包含开始时已有的记录，超过保留天数被删除的记录不包含在内
+    """
+    await flush_records()
+    async with get_session() as db_session:
+        max_id = await db_session.scalar(select(func.max(MemeGenerationRecord.id)))
+    if max_id is None:
+        return
+
+    whereclause: list[ColumnElement[bool]] = [MemeGenerationRecord.id <= max_id]
+    if meme_key:
+        whereclause.append(MemeGenerationRecord.meme_key == meme_key)
+    if time_start:
+        whereclause.append(MemeGenerationRecord.time >= remove_timezone(time_start))
+    if time_stop:
+        whereclause.append(MemeGenerationRecord.time <= remove_timezone(time_stop))
+
+    last_id = 0
+    while True:
+        statement = (
+            join_session_models(
+                select(
+                    MemeGenerationRecord.id,
+                    MemeGenerationRecord.time,
+                    MemeGenerationRecord.meme_key,
+                    BotModel.scope,
+                    BotModel.self_id,
+                    SceneModel.scene_type,
+                    SceneModel.scene_id,
+                    UserModel.user_id,
+                ),
+                MemeGenerationRecord,
+            )
+            .where(MemeGenerationRecord.id > last_id, *whereclause)
+            .order_by(MemeGenerationRecord.id)
+            .limit(batch_size)
+        )
+        async with get_session() as db_session:
+            results = (await db_session.execute(statement)).all()
+        if not results:
+            return
+        yield [MemeRecordDetail(*result) for result in results]
+        last_id = results[-1][0]
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+from typing import Any, Callable, Optional, TypeVar
+
+from meme_generator import Meme
+from nonebot import get_driver
+from nonebot.log import logger
+
+from .cache import plot_font_cache_file
+from .config import memes_config
+from .worker import RenderContext, generate_meme, generate_preview, init_worker
+
+R = TypeVar("R")
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+_executor: Optional[Executor] = None
+_pending_jobs = 0
+
+
+def use_process_pool() -> bool:
+    return memes_config.memes_render_backend == "process"
+
+
+def max_workers() -> int:
+    if workers := memes_config.memes_render_workers:
+        return workers
+    if use_process_pool():
+        return os.cpu_count() or 1
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if use_process_pool():
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers(),
+                mp_context=RenderContext(),
+                initializer=init_worker,
+                initargs=(memes_config.memes_plot_warmup, plot_font_cache_file),
+            )
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers(), thread_name_prefix="memes_render"
+            )
+    return _executor
+
+
+def shutdown_executor(cancel_futures: bool = True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=cancel_futures)
+        _executor = None
+
+
+async def run_in_executor(func: Callable[..., R], *args: Any) -> R:
+    """在渲染线程池/进程池中执行任务
+
+    使用进程池时 `func` 及其参数需要可以被 pickle
+    """
+    global _pending_jobs
+    max_queued = memes_config.memes_render_max_queued
+    if max_queued > 0 and _pending_jobs >= max_workers() + max_queued:
+        raise RenderQueueFull
+
+    loop = asyncio.get_running_loop()
+    _pending_jobs += 1
+    try:
+        return await loop.run_in_executor(get_executor(), partial(func, *args))
+    except BrokenProcessPool:
+        logger.warning("表情渲染进程池异常退出，将在下次调用时重建")
+        shutdown_executor()
+        raise
+    finally:
+        _pending_jobs -= 1
+
+
+async def render_meme(
+    meme: Meme, images: list[bytes], texts: list[str], args: dict[str, Any]
+) -> BytesIO:
+    if use_process_pool():
+        result = await run_in_executor(generate_meme, meme.key, images, texts, args)
+        return BytesIO(result)
+    return await run_in_executor(partial(meme, images=images, texts=texts, args=args))
+
+
+async def render_preview(meme: Meme) -> BytesIO:
+    if use_process_pool():
+        return BytesIO(await run_in_executor(generate_preview, meme.key))
+    return await run_in_executor(meme.generate_preview)
+
+
+driver = get_driver()
+
+
+@driver.on_shutdown
+async def _():
+    shutdown_executor()
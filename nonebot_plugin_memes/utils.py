@@ -1,24 +1,70 @@
 import asyncio
-from datetime import datetime, timezone
+import random
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional
 
 import httpx
+from nonebot import get_driver
 from nonebot.log import logger
 
+if TYPE_CHECKING:
+    import numpy as np
+
 
 class NetworkError(Exception):
     pass
 
 
-async def download_url(url: str) -> bytes:
-    async with httpx.AsyncClient() as client:
-        for i in range(3):
-            try:
-                resp = await client.get(url, timeout=20)
-                resp.raise_for_status()
-                return resp.content
-            except Exception as e:
-                logger.warning(f"Error downloading {url}, retry {i}/3: {e}")
-                await asyncio.sleep(3)
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取插件共用的 http 客户端，复用连接"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=64, max_keepalive_connections=16, keepalive_expiry=30
+            ),
+            timeout=20,
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        status_code = e.response.status_code
+        # 除超时和限流外的 4xx 错误重试也不会成功
+        return not (400 <= status_code < 500) or status_code in (408, 429)
+    return isinstance(e, httpx.HTTPError)
+
+
+async def download_url(url: str, retries: int = 3) -> bytes:
+    client = get_http_client()
+    for i in range(retries):
+        try:
+            resp = await client.get(url)
+            resp.raise_for_status()
+            return resp.content
+        except Exception as e:
+            logger.warning(f"Error downloading {url}, retry {i}/{retries}: {e}")
+            if not is_retryable(e):
+                break
+            if i < retries - 1:
+                # 带随机抖动的指数退避
+                delay = 0.5 * 2**i
+                await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
     raise NetworkError(f"{url} 下载失败！")
 
 
@@ -36,3 +82,65 @@ def add_timezone(dt: datetime) -> datetime:
     if dt.tzinfo is not None:
         return dt.astimezone()
     return dt.replace(tzinfo=timezone.utc).astimezone()
+
+
+driver = get_driver()
+
+
+@driver.on_shutdown
+async def _():
+    await close_http_client()
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_datetime64(times: Sequence[datetime]) -> "np.ndarray":
+    """将时间转换为 UTC 的 `datetime64[us]` 数组
+
+    numpy 直接转换 `datetime` 对象很慢，先转换为整数微秒
+    """
+    # numpy 只在统计时用到，不在插件加载时导入
+    import numpy as np
+
+    return np.fromiter(
+        ((remove_timezone(time) - _EPOCH) // _MICROSECOND for time in times),
+        dtype=np.int64,
+        count=len(times),
+    ).view("datetime64[us]")
+
+
+def count_by_edges(
+    times: Sequence[datetime],
+    edges: Sequence[datetime],
+    weights: Optional[Sequence[int]] = None,
+) -> list[int]:
+    """统计各时段内的数量
+
+    第 i 个时段为 `[edges[i], edges[i + 1])`，最后一个时段不设上限，
+    早于 `edges[0]` 的忽略；`weights` 为每个时间对应的数量，默认为 1
+    """
+    import numpy as np
+
+    indices = np.searchsorted(to_datetime64(edges), to_datetime64(times), "right") - 1
+    mask = indices >= 0
+    counts = np.bincount(
+        indices[mask],
+        weights=None if weights is None else np.asarray(weights)[mask],
+        minlength=len(edges),
+    )
+    return [int(count) for count in counts]
+
+
+startup_timings: dict[str, float] = {}
+
+
+@contextmanager
+def startup_phase(name: str) -> Iterator[None]:
+    """记录插件加载时某一阶段的耗时（单位：秒）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
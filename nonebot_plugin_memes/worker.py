@@ -0,0 +1,211 @@
+"""渲染进程池中执行的任务
+
+本模块只依赖 meme_generator 和 matplotlib，不导入插件的其他模块；
+进程池使用 `RenderContext` 启动子进程，子进程不会执行机器人的入口文件，
+而是执行 `worker_main.py`，按模块名导入本模块时不会执行插件包的 `__init__.py`
+"""
+
+import json
+import sys
+import threading
+import types
+from io import BytesIO
+from multiprocessing.context import SpawnContext, SpawnProcess
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+
+_worker_main = types.ModuleType("__main__")
+_worker_main.__file__ = str(Path(__file__).parent / "worker_main.py")
+_spawn_lock = threading.Lock()
+
+
+class RenderProcess(SpawnProcess):
+    """渲染进程
+
+    spawn 方式启动的子进程默认会重新执行主进程的 `__main__`，即机器人的入口文件，
+    使每个渲染进程都初始化 NoneBot 并加载全部插件；
+    这里在启动子进程时将主模块临时替换为 `worker_main.py`
+    """
+
+    @staticmethod
+    def _Popen(process_obj):
+        with _spawn_lock:
+            main_module = sys.modules["__main__"]
+            sys.modules["__main__"] = _worker_main
+            try:
+                return SpawnProcess._Popen(process_obj)
+            finally:
+                sys.modules["__main__"] = main_module
+
+
+class RenderContext(SpawnContext):
+    Process = RenderProcess
+
+
+def init_worker(warmup_plot: bool = False, font_cache_file: Optional[Path] = None):
+    # 子进程中导入 meme_generator 时会加载全部表情
+    import meme_generator  # noqa: F401
+
+    if warmup_plot:
+        init_matplotlib(font_cache_file)
+
+
+def generate_meme(
+    meme_key: str, images: list[bytes], texts: list[str], args: dict[str, Any]
+) -> bytes:
+    from meme_generator import get_meme
+
+    meme = get_meme(meme_key)
+    return meme(images=images, texts=texts, args=args).getvalue()
+
+
+def generate_preview(meme_key: str) -> bytes:
+    from meme_generator import get_meme
+
+    meme = get_meme(meme_key)
+    return meme.generate_preview().getvalue()
+
+
+fallback_fonts = [
+    "PingFang SC",
+    "Hiragino Sans GB",
+    "Microsoft YaHei",
+    "Source Han Sans SC",
+    "Noto Sans SC",
+    "Noto Sans CJK SC",
+    "WenQuanYi Micro Hei",
+]
+
+# matplotlib 导入较慢，在第一次绘图时再导入并初始化
+_initialized = False
+_init_lock = threading.Lock()
+# 不经过 pyplot 创建图表，图表不会被全局保存，用完即可释放；
+# matplotlib 不保证线程安全，同一进程中的绘制依次进行
+_plot_lock = threading.Lock()
+
+
+def resolve_fonts(version: str, cache_file: Optional[Path] = None) -> list[str]:
+    """检测可用的中文字体，结果按 matplotlib 版本缓存在文件中"""
+    if cache_file:
+        try:
+            cache = json.loads(cache_file.read_text("utf-8"))
+            if cache["version"] == version and cache["candidates"] == fallback_fonts:
+                return cache["fonts"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    from matplotlib.font_manager import fontManager
+
+    fonts: list[str] = []
+    for fontfamily in fallback_fonts:
+        try:
+            fontManager.findfont(fontfamily, fallback_to_default=False)
+            fonts.append(fontfamily)
+        except ValueError:
+            pass
+    if cache_file:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(
+                json.dumps(
+                    {"version": version, "candidates": fallback_fonts, "fonts": fonts}
+                ),
+                "utf-8",
+            )
+        except OSError:
+            # 缓存失败时下次重新检测
+            pass
+    return fonts
+
+
+def init_matplotlib(font_cache_file: Optional[Path] = None):
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        import matplotlib
+        from matplotlib import style
+
+        matplotlib.use("agg")
+        style.use("bmh")
+        matplotlib.rcParams["font.family"] = resolve_fonts(
+            matplotlib.__version__, font_cache_file
+        )
+        _initialized = True
+
+
+def save_figure(fig: "Figure") -> bytes:
+    output = BytesIO()
+    try:
+        fig.savefig(output, bbox_inches="tight", pad_inches=0.2)
+    finally:
+        fig.clear()
+    return output.getvalue()
+
+
+def plot_meme_and_duration_counts(
+    meme_counts: dict[str, int],
+    duration_counts: dict[str, int],
+    title: str,
+    font_cache_file: Optional[Path] = None,
+) -> bytes:
+    up_x = list(meme_counts.keys())
+    up_y = list(meme_counts.values())
+    low_x = list(duration_counts.keys())
+    low_y = list(duration_counts.values())
+    num = len(up_x)
+    up_height = num * 0.3
+    low_height = 3
+    fig_width = 8
+    init_matplotlib(font_cache_file)
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import MaxNLocator
+
+    with _plot_lock:
+        fig = Figure(
+            figsize=(fig_width, up_height + low_height), constrained_layout=True
+        )
+        axs = fig.subplots(nrows=2, height_ratios=[up_height, low_height])
+        up: Axes = axs[0]
+        up.barh(range(num), up_y, height=0.5)
+        up.set_ylim(-1, num)
+        up.set_yticks(range(num), up_x)
+        up.xaxis.set_major_locator(MaxNLocator(integer=True))
+        low: Axes = axs[1]
+        low.plot(low_x, low_y, marker="o")
+        if len(low_x) > 24:
+            low.set_xticks(low_x[::3])
+        elif len(low_x) > 12:
+            low.set_xticks(low_x[::2])
+        low.yaxis.set_major_locator(MaxNLocator(integer=True))
+        fig.suptitle(title)
+        return save_figure(fig)
+
+
+def plot_duration_counts(
+    duration_counts: dict[str, int],
+    title: str,
+    font_cache_file: Optional[Path] = None,
+) -> bytes:
+    x = list(duration_counts.keys())
+    y = list(duration_counts.values())
+    init_matplotlib(font_cache_file)
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import MaxNLocator
+
+    with _plot_lock:
+        fig = Figure(figsize=(6, 4), constrained_layout=True)
+        ax = fig.subplots()
+        ax.plot(x, y, marker="o")
+        if len(x) > 24:
+            ax.set_xticks(x[::3])
+        elif len(x) > 12:
+            ax.set_xticks(x[::2])
+        ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+        fig.suptitle(title)
+        return save_figure(fig)
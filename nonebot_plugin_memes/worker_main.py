@@ -0,0 +1,15 @@
+"""渲染进程的主模块
+
+渲染进程启动时执行本文件，代替机器人的入口文件；
+这里注册一个不执行 `__init__.py` 的插件包，
+使 `nonebot_plugin_memes.worker` 可以在未初始化 NoneBot 的进程中按模块名导入
+"""
+
+import sys
+import types
+from pathlib import Path
+
+if "nonebot_plugin_memes" not in sys.modules:
+    package = types.ModuleType("nonebot_plugin_memes")
+    package.__path__ = [str(Path(__file__).parent)]
+    sys.modules["nonebot_plugin_memes"] = package
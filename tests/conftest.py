@@ -0,0 +1,32 @@
+import tempfile
+from pathlib import Path
+
+import nonebot
+import pytest
+
+
+def pytest_addoption(parser: pytest.Parser):
+    parser.addoption(
+        "--run-slow", action="store_true", help="运行耗时较长的测试，如绘图内存测试"
+    )
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]):
+    if config.getoption("--run-slow"):
+        return
+    skip_slow = pytest.mark.skip(reason="需要 --run-slow 选项")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
+def pytest_configure(config: pytest.Config):
+    config.addinivalue_line("markers", "slow: 耗时较长的测试，默认跳过")
+    root = Path(tempfile.mkdtemp(prefix="nonebot_plugin_memes_"))
+    nonebot.init(
+        localstore_cache_dir=root / "cache",
+        localstore_config_dir=root / "config",
+        localstore_data_dir=root / "data",
+        memes_check_resources_on_startup=False,
+    )
+    nonebot.load_plugin("nonebot_plugin_memes")
@@ -0,0 +1,67 @@
+import pytest
+from meme_generator import Meme, MemeParamsType
+from meme_generator.meme import CommandShortcut
+
+from nonebot_plugin_memes.matchers.dispatch import MemeTrie, literal_prefix
+
+
+@pytest.mark.parametrize(
+    ("pattern", "prefix"),
+    [
+        ("摸摸", "摸摸"),
+        ("摸摸头?", "摸摸"),
+        ("摸+", "摸"),
+        ("摸摸(?P<name>\\S+)", "摸摸"),
+        ("a{2}", ""),
+        (".*摸", ""),
+        ("(?:摸|拍)头", ""),
+        ("摸头|拍头", ""),
+        ("摸(头|脸)", "摸"),
+        ("摸[|]头", "摸"),
+        ("摸[]|]头", "摸"),
+        ("摸\\|头", "摸"),
+        ("摸\\(头|拍", ""),
+    ],
+)
+def test_literal_prefix(pattern: str, prefix: str):
+    assert literal_prefix(pattern) == prefix
+
+
+def make_meme(key: str, keywords: list[str], shortcuts: tuple[str, ...] = ()) -> Meme:
+    return Meme(
+        key,
+        lambda images, texts, args: None,  # type: ignore
+        MemeParamsType(),
+        keywords=keywords,
+        shortcuts=[CommandShortcut(key=shortcut) for shortcut in shortcuts],
+    )
+
+
+@pytest.fixture
+def trie() -> MemeTrie:
+    return MemeTrie(
+        [
+            make_meme("petpet", ["摸", "摸摸"], ["摸摸头"]),
+            make_meme("pat", ["拍"], ["拍拍|打头"]),
+            make_meme("kiss", ["亲", "亲亲"]),
+        ]
+    )
+
+
+def test_trie_match_keywords(trie: MemeTrie):
+    assert trie.match("摸摸 @someone") == ["petpet"]
+    assert trie.match("亲亲") == ["kiss"]
+    assert trie.match("抱抱") == []
+
+
+def test_trie_match_longest_first(trie: MemeTrie):
+    trie.add("亲亲", "petpet")
+    assert trie.match("亲亲") == ["kiss", "petpet"]
+    assert trie.match("亲") == ["kiss"]
+
+
+def test_trie_match_alternation_shortcut(trie: MemeTrie):
+    # 含顶层 `|` 的快捷指令用正则表达式检查
+    assert trie.match("打头") == ["pat"]
+    assert trie.match("拍拍") == ["pat"]
+    assert trie.match("打") == []
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_memes.limiter import AdmissionController, Overloaded
+
+
+def test_waiters_admitted_in_arrival_order():
+    async def run() -> list[int]:
+        controller = AdmissionController(1, 0, 0, 0)
+        order: list[int] = []
+        release = asyncio.Event()
+
+        async def request(index: int):
+            async with controller.acquire(f"scene{index}"):
+                order.append(index)
+                await release.wait()
+
+        first = asyncio.create_task(request(0))
+        await asyncio.sleep(0)
+        tasks = []
+        for index in range(1, 6):
+            assert controller.queue_position(f"scene{index}") == index
+            tasks.append(asyncio.create_task(request(index)))
+            await asyncio.sleep(0)
+        assert controller.stats.queued == 5
+        release.set()
+        await asyncio.gather(first, *tasks)
+        return order
+
+    assert asyncio.run(run()) == [0, 1, 2, 3, 4, 5]
+
+
+def test_blocked_scene_does_not_hold_up_others():
+    async def run() -> list[str]:
+        controller = AdmissionController(2, 1, 0, 0)
+        order: list[str] = []
+        release = asyncio.Event()
+
+        async def request(scene_id: str):
+            async with controller.acquire(scene_id):
+                order.append(scene_id)
+                await release.wait()
+
+        tasks = [asyncio.create_task(request(scene_id)) for scene_id in "aab"]
+        await asyncio.sleep(0)
+        # 会话 a 的第二个请求在等待，会话 b 的请求不受影响
+        assert order == ["a", "b"]
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["a", "b", "a"]
+
+
+def test_queue_full_and_timeout():
+    async def run():
+        controller = AdmissionController(1, 0, 1, 0.05)
+        async with controller.acquire("a"):
+            waiter = asyncio.create_task(controller.acquire("b").__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(Overloaded) as full:
+                async with controller.acquire("c"):
+                    pass
+            assert not full.value.timeout
+            with pytest.raises(Overloaded) as timeout:
+                await waiter
+            assert timeout.value.timeout
+        assert controller.stats.running == 0
+        assert controller.stats.queued == 0
+        assert controller.stats.rejected == 1
+        assert controller.stats.timeout == 1
+
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from nonebot_plugin_memes import worker
+
+resource = pytest.importorskip("resource")
+
+ITERATIONS = 1000
+WARMUP = 20
+MAX_GROWTH_KB = 32 * 1024
+
+duration_counts = {"1": 1, "2": 3, "3": 2}
+meme_counts = {"petpet": 3, "jiji_king": 2}
+
+
+def plot(i: int) -> bytes:
+    if i % 2:
+        return worker.plot_duration_counts(duration_counts, "测试")
+    return worker.plot_meme_and_duration_counts(meme_counts, duration_counts, "测试")
+
+
+def max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@pytest.fixture(autouse=True)
+def _ignore_missing_glyphs():
+    # 测试环境中可能没有中文字体
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        yield
+
+
+@pytest.mark.slow
+def test_plot_memory_in_process():
+    for i in range(WARMUP):
+        plot(i)
+    before = max_rss()
+    for i in range(ITERATIONS):
+        assert plot(i)
+    assert max_rss() - before < MAX_GROWTH_KB
+
+
+@pytest.mark.slow
+def test_plot_memory_in_worker_process():
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=worker.RenderContext(),
+        initializer=worker.init_worker,
+    ) as executor:
+        for i in range(WARMUP):
+            executor.submit(plot, i).result()
+        before = executor.submit(max_rss).result()
+        for i in range(ITERATIONS):
+            assert executor.submit(plot, i).result()
+        after = executor.submit(max_rss).result()
+    assert after - before < MAX_GROWTH_KB
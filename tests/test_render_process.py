@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BOT_SCRIPT = """
+import asyncio
+import os
+
+import nonebot
+
+# 与 nb-cli 生成的 bot.py 相同，在顶层初始化 NoneBot 并加载插件
+with open("entries.txt", "a") as f:
+    f.write(f"{os.getpid()}\\n")
+
+nonebot.init(
+    localstore_use_cwd=True,
+    memes_check_resources_on_startup=False,
+    memes_render_backend="process",
+    memes_render_workers=2,
+)
+nonebot.load_plugin("nonebot_plugin_memes")
+
+
+async def main():
+    from meme_generator import get_meme
+
+    from nonebot_plugin_memes.render import render_meme, shutdown_executor
+
+    meme = get_meme("google")
+    results = await asyncio.gather(
+        *(render_meme(meme, [], ["text"], {}) for _ in range(4))
+    )
+    assert all(result.getvalue() for result in results)
+    shutdown_executor()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+"""
+
+
+def test_workers_do_not_run_entry_script(tmp_path: Path):
+    (tmp_path / "bot.py").write_text(BOT_SCRIPT, "utf-8")
+    root = Path(__file__).parent.parent
+    subprocess.run(
+        [sys.executable, "bot.py"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(root)},
+        check=True,
+        timeout=120,
+    )
+    assert len((tmp_path / "entries.txt").read_text().splitlines()) == 1
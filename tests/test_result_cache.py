@@ -0,0 +1,58 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+from meme_generator import get_meme
+
+from nonebot_plugin_memes.cache import is_result_cacheable
+from nonebot_plugin_memes.matchers import command
+
+
+@pytest.fixture
+def render_calls(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    calls: list[str] = []
+
+    async def render_meme(meme, images, texts, args) -> BytesIO:
+        calls.append(meme.key)
+        return BytesIO(f"{meme.key}-{len(calls)}".encode())
+
+    monkeypatch.setattr(command, "render_meme", render_meme)
+    return calls
+
+
+def render_twice(meme_key: str) -> tuple[bytes, bytes]:
+    meme = get_meme(meme_key)
+
+    async def run():
+        first = await command.render_meme_result(meme, [b"image"], ["text"], {})
+        second = await command.render_meme_result(meme, [b"image"], ["text"], {})
+        return first, second
+
+    return asyncio.run(run())
+
+
+def test_random_meme_not_cached(render_calls: list[str]):
+    assert not is_result_cacheable(get_meme("name_generator"))
+    first, second = render_twice("name_generator")
+    assert render_calls == ["name_generator", "name_generator"]
+    assert first != second
+
+
+def test_current_time_meme_not_cached(render_calls: list[str]):
+    assert not is_result_cacheable(get_meme("repeat"))
+    render_twice("repeat")
+    assert render_calls == ["repeat", "repeat"]
+
+
+def test_deterministic_meme_cached(render_calls: list[str]):
+    assert is_result_cacheable(get_meme("petpet"))
+    first, second = render_twice("petpet")
+    assert render_calls == ["petpet"]
+    assert first == second
+
+
+def test_skip_list(render_calls: list[str], monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        command.memes_config, "memes_result_cache_skip_list", ["petpet"]
+    )
+    assert not is_result_cacheable(get_meme("petpet"))